@@ -1,20 +1,43 @@
-import datetime
+import argparse
+import atexit
+from concurrent.futures import wait as wait_for_futures
 from functools import wraps
+import hashlib
 import json
 import logging
+import os
+import secrets
+import subprocess
+import sys
 from pathlib import Path
-from typing import Dict
-
-from flask import Flask, render_template, request, redirect, url_for, g, send_from_directory
-from server.db.db import DB
+from threading import BoundedSemaphore
+from types import MappingProxyType
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from flask import (Flask, Response, abort, get_template_attribute, make_response, render_template, request, redirect,
+                   url_for, g, send_file, jsonify, stream_template, stream_with_context)
+from werkzeug.serving import is_running_from_reloader
+from server.barcode_index import BarcodeIndex, normalize_barcode
+from server.bulk_io import TABLES as BULK_TABLES, BulkFormat, export_rows, import_rows
+from server.db.db import DB, DBPool
+from server.db.barcode_allocator import BarcodeAllocator, BarcodeNamespace
 from server.db.helpers import create_sample_data, drop_all_data
-from server.qr import generate_qr_code
-from server.barcodes import generate_barcode
+from server.db.repository import ToolRepository, UserRepository
+from server.labels import LabelCache, LabelKind, LabelRenderer, label_filename, parse_label_filename
+from server.loan_log import LoanEventKind, LoanLog
+from server.loans import LoanFailure, Loans
+from server.pictures import (PictureStore, PictureVariant, ReleasedPicture, StagedPicture, is_picture_name,
+                             make_variants, variant_path)
+from server.serve import DEFAULT_THREADS, default_workers, max_event_streams, serve
+from server.snapshot_cache import SnapshotCache
 from server.tool import Tool
+from server.tool_feed import ToolChange, ToolFeed, last_change_id
 from server.user import User
 
 app = Flask(__name__, static_folder='app/public_static', static_url_path='/static')
 app.template_folder = 'app/templates'
+# Uploads beyond Werkzeug's small in-memory threshold are spooled to temporary files; this caps their size
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024
 
 DATA_PATH = Path('data')
 DB_PATH = DATA_PATH / 'inventory.db'
@@ -22,23 +45,99 @@ TOOL_IMAGES_PATH = (DATA_PATH / 'tool_images').resolve()
 TOOL_IMAGES_PATH.mkdir(exist_ok=True)
 TOOL_BARCODES_PATH = (DATA_PATH / 'tool_barcodes').resolve()
 TOOL_BARCODES_PATH.mkdir(exist_ok=True)
+DB_POOL = DBPool(DB_PATH)
+LABELS = LabelRenderer(TOOL_BARCODES_PATH)
+PICTURES = PictureStore(TOOL_IMAGES_PATH)
+LABEL_CACHE = LabelCache(max_bytes=32 * 1024 * 1024)
+SNAPSHOTS = SnapshotCache()
+BARCODES = BarcodeIndex()
+LOAN_LOG = LoanLog(DB_PATH)
+atexit.register(LOAN_LOG.close)
+TOOL_FEED = ToolFeed(DB_PATH)
+# Mixed into page ETags so that a restart (e.g. with new templates) invalidates pages cached by browsers
+ETAG_SALT = secrets.token_hex(8)
+# The barcodes that each kind of label is printed for
+LABEL_NAMESPACES = {LabelKind.BARCODE: BarcodeNamespace.TOOLS, LabelKind.QR: BarcodeNamespace.USERS}
+# How long an image request waits for a label that is still being rendered before serving a placeholder
+LABEL_RENDER_WAIT_SECONDS = 2.0
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+STREAM_CHUNK_SIZE = 16 * 1024
+# Picture and label URLs never change content (see send_immutable), so browsers may keep them this long
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# An idle dashboard event stream sends a comment this often, so proxies don't drop it and dead clients are noticed
+EVENT_STREAM_KEEPALIVE_SECONDS = 15.0
+# Each open event stream holds a request thread. Past this many in a process, dashboards poll instead (see
+# dashboard_events), so that they can't take every thread. serve sizes it from --threads.
+EVENT_STREAMS = BoundedSemaphore(max_event_streams(DEFAULT_THREADS))
+# How long a polling dashboard waits for changes, and how long it then waits before asking again
+EVENT_POLL_WAIT_SECONDS = 1.0
+EVENT_POLL_INTERVAL_MS = 5000
+
+
+def conditional_on_data(view):
+    """Answer If-None-Match with 304 Not Modified while users and inventory are unchanged since the page was served.
+
+    The ETag is derived from the data generation, so the check costs a single read of the change counter
+    and skips the view's queries and template rendering entirely.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = hashlib.sha1(f'{ETAG_SALT}:{g.db.data_generation()}:{request.full_path}'.encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # Browsers may keep the page, but must revalidate it on every load
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+
+def mark_immutable(response: Response) -> Response:
+    """Let browsers and proxies reuse a response for as long as they like without revalidating it."""
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+def send_immutable(path: Path) -> Response:
+    """Serve an image file whose URL always refers to the same content, with ETag/Last-Modified and 304 handling.
+
+    Pictures are named after the hash of their content and variants after their picture, so a URL never needs
+    to be refetched. Raises FileNotFoundError if there is no such file.
+    """
+    response = send_file(path, conditional=True, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
 
 
 @app.before_request
 def set_request_globals():
-    """Set up a new database connection for each request."""
-    g.db = DB(DB_PATH)
-    g.db.connect()
+    """Check out a warm database connection from the pool for each request."""
+    g.db = DB_POOL.acquire()
 
 
 @app.after_request
-def cleanup(response):
-    """Clean up the database connection after each request."""
-    if hasattr(g, 'db'):
-        g.db.close()
+def poke_tool_feed(response):
+    """Let open dashboards pick up a write straight away rather than at the feed's next poll."""
+    if request.method == 'POST':
+        TOOL_FEED.poke()
     return response
 
 
+@app.teardown_request
+def cleanup(exc):
+    """Return the database connection to the pool after each request."""
+    db = g.pop('db', None)
+    if db is not None:
+        DB_POOL.release(db, rollback=exc is not None)
+
+
 @app.route('/')
 def index():
     return redirect(url_for('dashboard'))
@@ -51,50 +150,171 @@ def favicon():
 
 @app.route('/tool-image/<path:img>')
 def tool_image(img):
-    ensure_path_in_base(TOOL_IMAGES_PATH, TOOL_IMAGES_PATH / img)
-    return send_from_directory(TOOL_IMAGES_PATH, img)
+    if not is_picture_name(img):
+        abort(404)
+    try:
+        return send_immutable(TOOL_IMAGES_PATH / img)
+    except (FileNotFoundError, IsADirectoryError):
+        abort(404)
+
+
+@app.route('/tool-image/<any(thumb, display):variant>/<path:img>')
+def tool_image_variant(variant, img):
+    """A downscaled copy of a tool picture. Made from the original on first request if it doesn't exist yet,
+    e.g. for pictures uploaded before variants were introduced."""
+    if not is_picture_name(img):
+        abort(404)
+    path = variant_path(TOOL_IMAGES_PATH, img, PictureVariant(variant))
+    try:
+        return send_immutable(path)
+    except FileNotFoundError:
+        pass
+    try:
+        make_variants(TOOL_IMAGES_PATH, img)
+    except (FileNotFoundError, IsADirectoryError):
+        abort(404)
+    except OSError as e:
+        # Not something Pillow can read; the browser may still manage
+        app.logger.warning(f"Couldn't make variants of {img}: {e}")
+        return send_immutable(TOOL_IMAGES_PATH / img)
+    return send_immutable(path)
 
 
 @app.route('/tool-barcode/<path:img>')
 def tool_barcode(img):
-    ensure_path_in_base(TOOL_BARCODES_PATH, TOOL_BARCODES_PATH / img)
-    return send_from_directory(TOOL_BARCODES_PATH, img)
+    # Labels are rendered on first request, then served from memory, falling back to the copy on disk
+    label = parse_label_filename(img)
+    if label is None:
+        abort(404)
+    # A label's image only depends on its name, so the name is all the ETag needs
+    etag = hashlib.sha1(img.encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return mark_immutable(response)
+    data = LABEL_CACHE.get(img)
+    if data is None:
+        img_path = TOOL_BARCODES_PATH / img
+        if not img_path.exists():
+            # Only render labels of barcodes in use, so that requests for made-up codes can't fill the disk
+            kind, code = label
+            if BARCODES.lookup(g.db, LABEL_NAMESPACES[kind], code) is None:
+                abort(404)
+            LABELS.schedule(kind, code)
+            if not LABELS.wait(img, timeout=LABEL_RENDER_WAIT_SECONDS):
+                return redirect(url_for('static', filename='label_pending.svg'))
+        data = img_path.read_bytes()
+        LABEL_CACHE.put(img, data)
+    response = Response(data, mimetype='image/png')
+    response.set_etag(etag)
+    return mark_immutable(response)
+
+
+@app.route('/admin/db-stats')
+def db_stats():
+    return jsonify(DB_POOL.stats())
+
 
 @app.route('/dashboard')
+@conditional_on_data
 def dashboard():
+    # Read before the tools, so that live updates start no later than the page
+    since = last_change_id(g.db)
+    available_tools, signed_out_tools = cached(
+        ('dashboard',),
+        lambda: tuple(MappingProxyType(tools) for tools in ToolRepository(g.db).dashboard()))
     return render_template('dashboard.html.jinja2',
-                           users=get_users(),
-                           available_tools=get_available_tools(),
-                           signed_out_tools=get_signed_out_tools())
+                           available_tools=available_tools,
+                           signed_out_tools=signed_out_tools,
+                           since=since)
+
+
+@app.route('/dashboard/events')
+def dashboard_events():
+    """Server-sent events with the new row of every tool that changes after the dashboard was read.
+
+    Event ids are tool_changes ids, so a reconnecting browser resumes where it left off (Last-Event-ID).
+    A "reload" event asks the page to reload, when it fell too far behind to be caught up.
+
+    When EVENT_STREAMS are all taken, the response ends after at most EVENT_POLL_WAIT_SECONDS instead of
+    staying open, with a longer retry interval; the browser's reconnect then works as a poll.
+    """
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    since = int(since) if since and since.isdigit() else None
+    # The stream stays open for as long as the page does, so it shouldn't hold a pooled connection
+    DB_POOL.release(g.pop('db'))
+
+    def events():
+        streaming = EVENT_STREAMS.acquire(blocking=False)
+        subscription = TOOL_FEED.subscribe(since)
+        try:
+            yield 'retry: 2000\n\n' if streaming else f'retry: {EVENT_POLL_INTERVAL_MS}\n\n'
+            while True:
+                changes = subscription.wait(EVENT_STREAM_KEEPALIVE_SECONDS if streaming else EVENT_POLL_WAIT_SECONDS)
+                if changes is None:
+                    yield 'event: reload\ndata: {}\n\n'
+                    return
+                for change in changes:
+                    yield tool_change_event(change)
+                if not streaming:
+                    return
+                if not changes:
+                    yield ': keepalive\n\n'
+        finally:
+            TOOL_FEED.unsubscribe(subscription)
+            if streaming:
+                EVENT_STREAMS.release()
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    # Don't let a buffering reverse proxy hold events back
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @app.route('/manage-tools')
+@conditional_on_data
 def manage_tools():
-    return render_template('manage_tools.html.jinja2',
-                           users=get_users(),
-                           tools=get_inventory())
+    sort, descending, after, per_page = get_listing_args(ToolRepository.SORT_COLUMNS)
+    page = ToolRepository(g.db).stream_page(sort, after=after, limit=per_page, descending=descending)
+    return render_streamed('manage_tools.html.jinja2',
+                           tools=page,
+                           page=page,
+                           sort=sort,
+                           descending=descending)
 
 
 @app.route('/manage-users')
+@conditional_on_data
 def manage_users():
-    return render_template('manage_users.html.jinja2',
-                           users=get_users())
+    sort, descending, after, per_page = get_listing_args(UserRepository.SORT_COLUMNS)
+    page = UserRepository(g.db).stream_page(sort, after=after, limit=per_page, descending=descending)
+    return render_streamed('manage_users.html.jinja2',
+                           users=page,
+                           page=page,
+                           sort=sort,
+                           descending=descending)
 
 
 @app.route('/tool/<tool_id>')
+@conditional_on_data
 def tool_detail(tool_id):
-    tool = get_inventory().get(int(tool_id))
+    tool_id = int(tool_id)
+    tool = cached(('tool', tool_id), lambda: ToolRepository(g.db).get(tool_id))
     if tool is None:
         return redirect(url_for('dashboard', result=json.dumps({
             'success': False,
             'message': f"Tool with ID {tool_id} does not exist."
         })))
-    return render_template('tool_detail.html.jinja2', tool=tool, users=get_users())
+    history = cached(('tool_history', tool_id), lambda: ToolRepository(g.db).history(tool_id))
+    return render_template('tool_detail.html.jinja2', tool=tool, history=history)
 
 
 @app.route('/user/<user_id>')
+@conditional_on_data
 def user_detail(user_id):
-    user_item = get_users().get(int(user_id))
+    user_id = int(user_id)
+    user_item = cached(('user', user_id), lambda: UserRepository(g.db).get(user_id))
     if user_item is None:
         return redirect(url_for('dashboard', result=json.dumps({
             'success': False,
@@ -109,28 +329,17 @@ def add_tool():
     name = request.form.get('name')
     description = request.form.get('description')
     allocate_barcode = request.form.get('allocate_barcode')
-    barcode = request.form.get('barcode') or None
+    barcode = normalize_barcode(request.form.get('barcode'))
     picture_path = None
-    # Handle picture upload if provided
-    if 'picture' in request.files:
-        pic = request.files['picture']
-        if pic.filename != '':
-            picture_path = save_tool_picture().as_posix()
-
-    # Start exclusive transaction so that we know we allocate a unique barcode
-    g.db.cursor.execute('BEGIN EXCLUSIVE TRANSACTION')
+    # Handle picture upload if provided. Copy it before taking the write lock, and publish it once we hold it
+    staged_picture = stage_tool_picture()
+
+    # Take the write lock up front so that the barcode we allocate stays unique until we commit
+    g.db.cursor.execute('BEGIN IMMEDIATE TRANSACTION')
+    allocator = BarcodeAllocator(g.db, BarcodeNamespace.TOOLS)
     try:
         if allocate_barcode:
-            # Select the lowest open ID in the range [1, inf)
-            g.db.cursor.execute('''
-                SELECT MIN(t1.barcode + 1)
-                FROM inventory AS t1
-                LEFT JOIN inventory AS t2 ON t1.barcode + 1 = t2.barcode
-                WHERE t2.barcode IS NULL
-            ''')
-            barcode = g.db.cursor.fetchone()[0] or 1
-            # Generate and save QR code image
-            ensure_barcode(barcode)
+            barcode = normalize_barcode(allocator.allocate())
         elif barcode:
             # Make sure the barcode is not already allocated
             g.db.cursor.execute('SELECT name FROM inventory WHERE barcode = ?', (barcode,))
@@ -143,7 +352,9 @@ def add_tool():
                     'success': False,
                     'message': e_msg
                 })))
-            ensure_barcode(barcode)
+            allocator.claim(barcode)
+        if staged_picture is not None:
+            picture_path = staged_picture.name
         tool = Tool(tool_id=None, name=name, barcode=barcode, description=description, picture=picture_path,
                     signed_out=False, holder_id=None, signed_out_since=None)
         row, projection = tool.to_row_and_projection()
@@ -155,7 +366,15 @@ def add_tool():
             RETURNING id
         ''', row)
         new_id = g.db.cursor.fetchone()[0]
+        # Only once the tool refers to it, so that a failed insert doesn't leave a picture nothing refers to
+        if staged_picture is not None:
+            PICTURES.publish(staged_picture)
         g.db.conn.commit()
+        # Render the barcode image after committing so the write lock isn't held while we do it
+        if barcode:
+            ensure_barcode(barcode)
+        if picture_path:
+            make_picture_variants(picture_path)
         app.logger.info(f"New tool added: {name} (ID: {new_id})")
         return redirect(url_for('manage_tools', result=json.dumps({
             'success': True,
@@ -169,6 +388,9 @@ def add_tool():
             'success': False,
             'message': e_msg
         })))
+    finally:
+        if staged_picture is not None:
+            PICTURES.discard(staged_picture)
 
 
 @app.route('/admin/edit-tool', methods=['POST'])
@@ -177,22 +399,16 @@ def edit_tool():
     name = request.form.get('name')
     description = request.form.get('description')
     allocate_barcode = request.form.get('allocate_barcode')
-    barcode = request.form.get('barcode') or None
+    barcode = normalize_barcode(request.form.get('barcode'))
+    staged_picture = stage_tool_picture()
+    released_picture = None
 
     # Start transaction with SERIALIZABLE isolation
     g.db.cursor.execute('BEGIN IMMEDIATE TRANSACTION')
+    allocator = BarcodeAllocator(g.db, BarcodeNamespace.TOOLS)
     try:
         if allocate_barcode:
-            # Select the lowest open ID in the range [1, inf)
-            g.db.cursor.execute('''
-                SELECT MIN(t1.barcode + 1)
-                FROM inventory AS t1
-                LEFT JOIN inventory AS t2 ON t1.barcode + 1 = t2.barcode
-                WHERE t2.barcode IS NULL
-            ''')
-            barcode = g.db.cursor.fetchone()[0] or 1
-            # Generate and save QR code image
-            ensure_barcode(barcode)
+            barcode = normalize_barcode(allocator.allocate())
         elif barcode:
             # Make sure the barcode is not already allocated (other than to this tool)
             g.db.cursor.execute('SELECT name FROM inventory WHERE barcode = ? and id != ?', (barcode,tool_id))
@@ -205,18 +421,18 @@ def edit_tool():
                     'success': False,
                     'message': e_msg
                 })))
-            ensure_barcode(barcode)
+            allocator.claim(barcode)
 
-        # Get the current picture value
-        g.db.cursor.execute('SELECT picture FROM inventory WHERE id = ?', (tool_id,))
-        old_picture_path = g.db.cursor.fetchone()[0]
+        # Get the current picture and barcode values
+        g.db.cursor.execute('SELECT picture, barcode FROM inventory WHERE id = ?', (tool_id,))
+        old_picture_path, old_barcode = g.db.cursor.fetchone()
+        if old_barcode is not None and old_barcode != barcode:
+            allocator.release(old_barcode)
 
         # Handle picture upload if provided
         picture_path = old_picture_path
-        if 'picture' in request.files:
-            pic = request.files['picture']
-            if pic.filename != '':
-                picture_path = save_tool_picture().as_posix()
+        if staged_picture is not None:
+            picture_path = staged_picture.name
 
         # Update tool
         g.db.cursor.execute('''
@@ -224,19 +440,31 @@ def edit_tool():
             SET name = ?, barcode = ?, description = ?, picture = COALESCE(?, picture)
             WHERE id = ?
         ''', (name, barcode, description, picture_path, tool_id))
+        if staged_picture is not None:
+            PICTURES.publish(staged_picture)
+        if picture_path != old_picture_path and old_picture_path is not None:
+            released_picture = release_tool_image(old_picture_path)
 
         g.db.conn.commit()
-
-        if picture_path != old_picture_path and old_picture_path is not None:
-            safe_unlink_tool_image(old_picture_path)
+        if released_picture is not None:
+            PICTURES.delete(released_picture)
+        if barcode:
+            ensure_barcode(barcode)
+        if staged_picture is not None:
+            make_picture_variants(picture_path)
     except Exception as e:
         g.db.conn.rollback()
+        if released_picture is not None:
+            PICTURES.restore(released_picture)
         e_msg = f'Error updating tool: {e}'
         app.logger.error(e_msg)
         return redirect(url_for('manage_tools', result=json.dumps({
             'success': False,
             'message': e_msg
         })))
+    finally:
+        if staged_picture is not None:
+            PICTURES.discard(staged_picture)
     app.logger.info(f"Tool updated: {name} (ID: {tool_id})")
     return redirect(url_for('manage_tools', result=json.dumps({
         'success': True,
@@ -249,20 +477,26 @@ def delete_tool():
     tool_id = int(request.form.get('tool_id'))
 
     g.db.cursor.execute('BEGIN IMMEDIATE TRANSACTION')
-    old_picture_path = None
+    released_picture = None
     try:
-        g.db.cursor.execute('DELETE FROM inventory WHERE id = ? RETURNING name, picture', (tool_id,))
-        tool, old_picture_path = g.db.cursor.fetchone()
+        g.db.cursor.execute('DELETE FROM inventory WHERE id = ? RETURNING name, picture, barcode', (tool_id,))
+        tool, old_picture_path, old_barcode = g.db.cursor.fetchone()
+        BarcodeAllocator(g.db, BarcodeNamespace.TOOLS).release(old_barcode)
+        if old_picture_path:
+            released_picture = release_tool_image(old_picture_path)
+        g.db.conn.commit()
+        if released_picture is not None:
+            PICTURES.delete(released_picture)
     except Exception as e:
         g.db.conn.rollback()
+        if released_picture is not None:
+            PICTURES.restore(released_picture)
         e_msg = f'Error deleting tool: {e}'
         app.logger.error(e_msg)
         return redirect(url_for('manage_tools', result=json.dumps({
             'success': False,
             'message': e_msg
         })))
-    if old_picture_path:
-        safe_unlink_tool_image(old_picture_path)
     app.logger.info(f"Tool deleted: {tool} (ID: {tool_id})")
     return redirect(url_for('manage_tools', result=json.dumps({
         'success': True,
@@ -277,21 +511,10 @@ def borrow_tool():
     # Trust input from user.
     user_id = int(request.form.get('user_id'))
 
-    # Check if tool exists and is available
-    g.db.cursor.execute('''
-        SELECT signed_out FROM inventory 
-        WHERE id = ? AND signed_out = 0
-    ''', (tool_id,))
-    if g.db.cursor.fetchone():
-        # Update tool status
-        g.db.cursor.execute('''
-            UPDATE inventory 
-            SET signed_out = 1, 
-                holder_id = ?,
-                signed_out_since = ?
-            WHERE id = ?
-        ''', (user_id, datetime.datetime.now().isoformat(), tool_id))
-        g.db.conn.commit()
+    failure = Loans(g.db).borrow(tool_id, user_id)
+    g.db.conn.commit()
+    if failure is None:
+        LOAN_LOG.record(LoanEventKind.BORROW, [tool_id], user_id)
         app.logger.info(f"Tool {tool_id} has been borrowed by user {user_id}.")
     else:
         app.logger.warning(f"Attempt to borrow unavailable tool {tool_id}.")
@@ -304,21 +527,10 @@ def return_tool():
     tool_id = int(request.form.get('tool_id'))
     user_id = int(request.form.get('user_id'))
 
-    # Check if tool exists and is signed out
-    g.db.cursor.execute('''
-        SELECT signed_out FROM inventory 
-        WHERE id = ? AND signed_out = 1
-    ''', (tool_id,))
-    if g.db.cursor.fetchone():
-        # Update tool status
-        g.db.cursor.execute('''
-            UPDATE inventory 
-            SET signed_out = 0,
-                holder_id = NULL,
-                signed_out_since = NULL
-            WHERE id = ?
-        ''', (tool_id,))
-        g.db.conn.commit()
+    failure = Loans(g.db).give_back(tool_id)
+    g.db.conn.commit()
+    if failure is None:
+        LOAN_LOG.record(LoanEventKind.RETURN, [tool_id], user_id)
         app.logger.info(f"Tool {tool_id} has been returned by user {user_id}.")
     else:
         app.logger.warning(f"Attempt to return non-signed-out tool {tool_id}.")
@@ -326,29 +538,47 @@ def return_tool():
     return redirect(url_for('dashboard'))
 
 
+@app.route('/borrow-tools', methods=['POST'])
+def borrow_tools():
+    """Sign a cart of tools (repeated tool_id fields) out to one user in a single transaction."""
+    user_id = int(request.form.get('user_id'))
+    tool_ids = [int(tool_id) for tool_id in request.form.getlist('tool_id')]
+    outcomes = Loans(g.db).borrow_many(tool_ids, user_id)
+    g.db.conn.commit()
+    borrowed = [tool_id for tool_id, failure in outcomes.items() if failure is None]
+    LOAN_LOG.record(LoanEventKind.BORROW, borrowed, user_id)
+    app.logger.info(f"User {user_id} borrowed tools {borrowed}.")
+    return redirect(url_for('dashboard', result=json.dumps(cart_result(outcomes, 'signed out'))))
+
+
+@app.route('/return-tools', methods=['POST'])
+def return_tools():
+    """Return a cart of tools (repeated tool_id fields) in a single transaction."""
+    user_id = int(request.form.get('user_id'))
+    tool_ids = [int(tool_id) for tool_id in request.form.getlist('tool_id')]
+    outcomes = Loans(g.db).give_back_many(tool_ids)
+    g.db.conn.commit()
+    returned = [tool_id for tool_id, failure in outcomes.items() if failure is None]
+    LOAN_LOG.record(LoanEventKind.RETURN, returned, user_id)
+    app.logger.info(f"User {user_id} returned tools {returned}.")
+    return redirect(url_for('dashboard', result=json.dumps(cart_result(outcomes, 'returned'))))
+
+
 @app.route('/admin/add-user', methods=['POST'])
 def add_user():
     name = request.form.get('name')
     role = request.form.get('role')
     allocate_barcode = request.form.get('allocate_barcode')
-    barcode = request.form.get('barcode') or None
+    barcode = normalize_barcode(request.form.get('barcode'))
     is_admin, is_user = False, True
     if role.lower() == 'admin':
         is_admin = True
-    # Start exclusive transaction so that we know we allocate a unique barcode
-    g.db.cursor.execute('BEGIN EXCLUSIVE TRANSACTION')
+    # Take the write lock up front so that the barcode we allocate stays unique until we commit
+    g.db.cursor.execute('BEGIN IMMEDIATE TRANSACTION')
+    allocator = BarcodeAllocator(g.db, BarcodeNamespace.USERS)
     try:
         if allocate_barcode:
-            # Select the lowest open ID in the range [1, inf)
-            g.db.cursor.execute('''
-                SELECT MIN(t1.barcode + 1)
-                FROM users AS t1
-                LEFT JOIN users AS t2 ON t1.barcode + 1 = t2.barcode
-                WHERE t2.barcode IS NULL
-            ''')
-            barcode = g.db.cursor.fetchone()[0] or 1
-            # Generate and save QR code image
-            ensure_qr_code(barcode)
+            barcode = normalize_barcode(allocator.allocate())
         elif barcode:
             # Make sure the barcode is not already allocated
             g.db.cursor.execute('SELECT name FROM users WHERE barcode = ?', (barcode,))
@@ -361,7 +591,7 @@ def add_user():
                     'success': False,
                     'message': e_msg
                 })))
-            ensure_qr_code(barcode)
+            allocator.claim(barcode)
         user = User(user_id=None, name=name, barcode=barcode, is_admin=is_admin, is_user=is_user)
         row, projection = user.to_row_and_projection()
 
@@ -373,6 +603,9 @@ def add_user():
         ''', row)
         new_id = g.db.cursor.fetchone()[0]
         g.db.conn.commit()
+        # Render the QR code image after committing so the write lock isn't held while we do it
+        if barcode:
+            ensure_qr_code(barcode)
         app.logger.info(f"New user added: {name} (ID: {new_id})")
         return redirect(url_for('manage_users', result=json.dumps({
             'success': True,
@@ -394,24 +627,16 @@ def edit_user():
     name = request.form.get('name')
     role = request.form.get('role')
     allocate_barcode = request.form.get('allocate_barcode')
-    barcode = request.form.get('barcode') or None
+    barcode = normalize_barcode(request.form.get('barcode'))
     is_admin, is_user = False, True
     if role.lower() == 'admin':
         is_admin = True
     # Start transaction with SERIALIZABLE isolation
     g.db.cursor.execute('BEGIN IMMEDIATE TRANSACTION')
+    allocator = BarcodeAllocator(g.db, BarcodeNamespace.USERS)
     try:
         if allocate_barcode:
-            # Select the lowest open ID in the range [1, inf)
-            g.db.cursor.execute('''
-                SELECT MIN(t1.barcode + 1)
-                FROM users AS t1
-                LEFT JOIN users AS t2 ON t1.barcode + 1 = t2.barcode
-                WHERE t2.barcode IS NULL
-            ''')
-            barcode = g.db.cursor.fetchone()[0] or 1
-            # Generate and save QR code image
-            ensure_qr_code(barcode)
+            barcode = normalize_barcode(allocator.allocate())
         elif barcode:
             # Make sure the barcode is not already allocated (other than to this user)
             g.db.cursor.execute('SELECT name FROM users WHERE barcode = ? and id != ?',
@@ -425,7 +650,13 @@ def edit_user():
                     'success': False,
                     'message': e_msg
                 })))
-            ensure_qr_code(barcode)
+            allocator.claim(barcode)
+
+        # Give the old barcode back if it is being replaced
+        g.db.cursor.execute('SELECT barcode FROM users WHERE id = ?', (user_id,))
+        old_barcode = g.db.cursor.fetchone()[0]
+        if old_barcode is not None and old_barcode != barcode:
+            allocator.release(old_barcode)
 
         user = User(user_id=user_id, name=name, barcode=barcode, is_admin=is_admin, is_user=is_user)
         row, projections = user.to_row_and_projection()
@@ -437,6 +668,8 @@ def edit_user():
         ''', row + (row[0],))
 
         g.db.conn.commit()
+        if barcode:
+            ensure_qr_code(barcode)
     except Exception as e:
         g.db.conn.rollback()
         e_msg = f'Error updating user: {e}'
@@ -463,13 +696,19 @@ def delete_user():
             SET signed_out = 0,
                 holder_id = NULL,
                 signed_out_since = NULL
-            WHERE holder_id = ?
+            WHERE signed_out = 1 AND holder_id = ?
+            RETURNING id
         ''', (user_id,))
+        returned = [row[0] for row in g.db.cursor.fetchall()]
         # Delete user
         g.db.cursor.execute('''
-            DELETE FROM users WHERE id = ?
+            DELETE FROM users WHERE id = ? RETURNING barcode
         ''', (user_id,))
+        deleted = g.db.cursor.fetchone()
+        if deleted is not None:
+            BarcodeAllocator(g.db, BarcodeNamespace.USERS).release(deleted[0])
         g.db.conn.commit()
+        LOAN_LOG.record(LoanEventKind.RETURN, returned, user_id)
         return redirect(url_for('manage_users', result=json.dumps({
             'success': True,
             'message': f"User with ID {user_id} deleted successfully."
@@ -484,51 +723,306 @@ def delete_user():
         })))
 
 
-def get_users() -> Dict[int, User]:
-    g.db.cursor.execute(f'SELECT {', '.join(User.default_projection())} FROM users')
+@app.route('/admin/export/<kind>')
+def export_table(kind):
+    """Download a whole table as CSV or JSON lines, streamed from the database."""
+    table = BULK_TABLES.get(kind)
+    if table is None:
+        abort(404)
+    try:
+        fmt = BulkFormat(request.args.get('format', BulkFormat.CSV.value))
+    except ValueError:
+        abort(400)
+    return Response(stream_with_context(export_rows(g.db, table, fmt)),
+                    mimetype=fmt.mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={kind}.{fmt.value}'})
+
+
+@app.route('/admin/import/<kind>', methods=['POST'])
+def import_table(kind):
+    """Add the rows of an uploaded CSV or JSON lines file to a table."""
+    table = BULK_TABLES.get(kind)
+    if table is None:
+        abort(404)
+    listing = 'manage_tools' if kind == 'tools' else 'manage_users'
+    upload = request.files.get('file')
+    try:
+        fmt = BulkFormat(Path(upload.filename).suffix.lstrip('.').lower())
+    except (AttributeError, TypeError, ValueError):
+        return redirect(url_for(listing, result=json.dumps({
+            'success': False,
+            'message': 'Upload a .csv or .jsonl file to import.'
+        })))
+    report = import_rows(g.db, table, upload.stream, fmt, allocate_barcodes=bool(request.form.get('allocate_barcode')))
+    app.logger.info(f'Import into {kind}: {report.summary()}')
+    return redirect(url_for(listing, result=json.dumps({
+        'success': not report.errors,
+        'message': report.summary()
+    })))
+
+
+class ApiError(Exception):
+    """Rejects a JSON API request with a message and HTTP status."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@app.errorhandler(ApiError)
+def api_error(e: ApiError):
+    return jsonify({'success': False, 'message': e.message}), e.status
+
+
+@app.route('/api/v1/lookup')
+def api_lookup():
+    """The tool and the user with a scanned barcode. Tools and users number their barcodes separately."""
+    barcode = normalize_barcode(request.args.get('barcode'))
+    if barcode is None:
+        raise ApiError('barcode is required.')
+    tool_id = BARCODES.lookup(g.db, BarcodeNamespace.TOOLS, barcode)
+    user_id = BARCODES.lookup(g.db, BarcodeNamespace.USERS, barcode)
+    tool = ToolRepository(g.db).get(tool_id) if tool_id is not None else None
+    user = UserRepository(g.db).get(user_id) if user_id is not None else None
+    if tool is None and user is None:
+        raise ApiError(f'Nothing has barcode {barcode}.', 404)
+    return jsonify({
+        'success': True,
+        'tool': tool_json(tool) if tool is not None else None,
+        'user': user_json(user) if user is not None else None,
+    })
+
+
+@app.route('/api/v1/tools/search')
+def api_search_tools():
+    """Ranked full text search over tool names and descriptions, with prefix matching for typeahead."""
+    query = request.args.get('q', '')
+    after = request.args.get('after')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_PAGE_SIZE)
+    # Not cached: typeahead queries rarely repeat, and would push the pages that do out of SNAPSHOTS
+    page = ToolRepository(g.db).search(query, after, limit)
+    return jsonify({
+        'success': True,
+        'tools': [dict(tool_json(tool), url=url_for('tool_detail', tool_id=tool.tool_id))
+                  for tool in page.items.values()],
+        'next': page.next_cursor,
+    })
+
+
+@app.route('/api/v1/borrow', methods=['POST'])
+def api_borrow():
+    """Sign one tool out: {"tool_id" or "tool_barcode", "user_id" or "user_barcode"}."""
+    body = api_body()
+    return api_single_loan(LoanEventKind.BORROW, body, api_user_id(body))
+
+
+@app.route('/api/v1/return', methods=['POST'])
+def api_return():
+    """Return one tool: {"tool_id" or "tool_barcode", optionally "user_id" or "user_barcode"}."""
+    body = api_body()
+    return api_single_loan(LoanEventKind.RETURN, body, api_user_id(body, required=False))
+
+
+@app.route('/api/v1/batch', methods=['POST'])
+def api_batch():
+    """Sign out and return carts of tools in one transaction.
+
+    {"user_id" or "user_barcode", "borrow": [tool refs], "return": [tool refs]}, where each tool ref is
+    {"tool_id": ...} or {"tool_barcode": ...}. Answers with the outcome of every ref, in order.
+    """
+    body = api_body()
+    borrow_refs, return_refs = body.get('borrow', []), body.get('return', [])
+    if not isinstance(borrow_refs, list) or not isinstance(return_refs, list):
+        raise ApiError('borrow and return must be lists of tool refs.')
+    user_id = api_user_id(body, required=bool(borrow_refs))
+    borrow_ids = api_tool_ids(borrow_refs)
+    return_ids = api_tool_ids(return_refs)
+
+    loans = Loans(g.db)
+    borrowed = loans.borrow_many([tool_id for tool_id in borrow_ids if tool_id is not None], user_id)
+    returned = loans.give_back_many([tool_id for tool_id in return_ids if tool_id is not None])
+    g.db.conn.commit()
+    LOAN_LOG.record(LoanEventKind.BORROW, [t for t, failure in borrowed.items() if failure is None], user_id)
+    LOAN_LOG.record(LoanEventKind.RETURN, [t for t, failure in returned.items() if failure is None], user_id)
+
+    borrow_results = [api_loan_result(ref, tool_id, borrowed) for ref, tool_id in zip(borrow_refs, borrow_ids)]
+    return_results = [api_loan_result(ref, tool_id, returned) for ref, tool_id in zip(return_refs, return_ids)]
+    return jsonify({
+        'success': all(result['success'] for result in borrow_results + return_results),
+        'borrow': borrow_results,
+        'return': return_results,
+    })
+
+
+def api_single_loan(kind: LoanEventKind, body: Dict, user_id: Optional[int]):
+    tool_id = api_tool_ids([body])[0]
+    outcomes = {}
+    if tool_id is not None:
+        if kind is LoanEventKind.BORROW:
+            outcomes = Loans(g.db).borrow_many([tool_id], user_id)
+        else:
+            outcomes = Loans(g.db).give_back_many([tool_id])
+        g.db.conn.commit()
+        if outcomes[tool_id] is None:
+            LOAN_LOG.record(kind, [tool_id], user_id)
+    result = api_loan_result(body, tool_id, outcomes)
+    status = 200 if result['success'] else 404 if result['error'] == LoanFailure.NOT_FOUND.name.lower() else 409
+    return jsonify(result), status
+
+
+def api_body() -> Dict:
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError('Expected a JSON object.')
+    return body
+
+
+def api_user_id(body: Dict, required: bool = True) -> Optional[int]:
+    """The user a request acts for, given by user_id or user_barcode."""
+    if body.get('user_barcode') is not None:
+        user_id = BARCODES.lookup(g.db, BarcodeNamespace.USERS, body['user_barcode'])
+        if user_id is None:
+            raise ApiError(f"No user has barcode {body['user_barcode']}.", 404)
+        return user_id
+    if body.get('user_id') is not None:
+        user_id = body['user_id']
+        if not isinstance(user_id, int) or isinstance(user_id, bool):
+            raise ApiError('user_id must be a number.')
+        if UserRepository(g.db).get(user_id) is None:
+            raise ApiError(f'No user has ID {user_id}.', 404)
+        return user_id
+    if required:
+        raise ApiError('user_id or user_barcode is required.')
+    return None
+
+
+def api_tool_ids(refs: list) -> list[Optional[int]]:
+    """Tool ids for tool refs, with None for barcodes no tool has."""
+    tool_ids = []
+    for ref in refs:
+        if not isinstance(ref, dict):
+            raise ApiError('Tool refs must be objects.')
+        if ref.get('tool_barcode') is not None:
+            tool_ids.append(BARCODES.lookup(g.db, BarcodeNamespace.TOOLS, ref['tool_barcode']))
+        elif isinstance(ref.get('tool_id'), int) and not isinstance(ref['tool_id'], bool):
+            tool_ids.append(ref['tool_id'])
+        else:
+            raise ApiError('Each tool needs a numeric tool_id or a tool_barcode.')
+    return tool_ids
+
+
+def api_loan_result(ref: Dict, tool_id: Optional[int], outcomes: Dict[int, Optional[LoanFailure]]) -> Dict:
+    failure = outcomes.get(tool_id, LoanFailure.NOT_FOUND)
+    result = {key: ref[key] for key in ('tool_id', 'tool_barcode') if key in ref}
+    result.update({
+        'tool_id': tool_id,
+        'success': failure is None,
+        'error': failure.name.lower() if failure is not None else None,
+    })
+    if failure is not None:
+        result['message'] = f"Tool {ref.get('tool_barcode', tool_id)} {failure.value}."
+    return result
+
+
+def tool_json(tool: Tool) -> Dict:
     return {
-        row[0]: User.from_row(row)
-        for row in g.db.cursor.fetchall()
+        'tool_id': tool.tool_id,
+        'name': tool.name,
+        'barcode': tool.barcode,
+        'signed_out': tool.signed_out,
+        'holder_id': tool.holder_id,
+        'holder_name': tool.holder_name,
+        'signed_out_since': tool.signed_out_since.isoformat() if tool.signed_out_since else None,
     }
 
-def get_inventory() -> Dict[int, Tool]:
-    g.db.cursor.execute(f'''
-        SELECT {', '.join(Tool.default_projection())} 
-        FROM inventory
-    ''')
+
+def user_json(user: User) -> Dict:
     return {
-        row[0]: Tool.from_row(row)
-        for row in g.db.cursor.fetchall()
+        'user_id': user.user_id,
+        'name': user.name,
+        'barcode': user.barcode,
+        'is_admin': user.is_admin,
+        'is_user': user.is_user,
     }
 
-def get_available_tools() -> Dict[int, Tool]:
-    # TODO SQL
-    return {tool_id: tool for tool_id, tool in get_inventory().items() if not tool.signed_out}
+
+T = TypeVar('T')
+
+
+def cached(key: Hashable, load: Callable[[], T]) -> T:
+    """Serve a read from the snapshot cache, only running load if users or inventory changed since it was cached.
+
+    The result is shared between requests and must not be modified.
+    """
+    return SNAPSHOTS.get(key, g.db.data_generation(), load)
+
+
+def render_streamed(template_name: str, **context) -> Response:
+    """Render a template as a streamed response, sent as the rows of the listing are read from the database.
+
+    The pooled connection stays checked out until the stream is finished, since the request context is kept
+    alive for it. Jinja yields output in small pieces, so they are joined into chunks of about
+    STREAM_CHUNK_SIZE characters before being written.
+    """
+    return Response(_join_chunks(stream_template(template_name, **context)), mimetype='text/html')
+
+
+def _join_chunks(pieces: Iterable[str]) -> Iterator[str]:
+    chunk, size = [], 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
 
 
-def get_signed_out_tools() -> Dict[int, Tool]:
-    # TODO SQL
-    return {tool_id: tool for tool_id, tool in get_inventory().items() if tool.signed_out}
+def tool_change_event(change: ToolChange) -> str:
+    """A dashboard_events message with the changed tool's row and the table it now belongs in."""
+    section, row = None, None
+    if change.tool is not None:
+        section = 'signed_out' if change.tool.signed_out else 'available'
+        row = str(get_template_attribute('_dashboard_rows.html.jinja2', 'tool_row')(change.tool))
+    data = json.dumps({'tool_id': change.tool_id, 'section': section, 'row': row})
+    return f'id: {change.change_id}\nevent: tool\ndata: {data}\n\n'
 
 
-def get_my_tools(user_id: int) -> Dict[int, Tool]:
-    # TODO SQL
+def cart_result(outcomes: Dict[int, Optional[LoanFailure]], done: str) -> Dict:
+    """Result message for a cart operation, with the outcome of each tool."""
+    succeeded = sum(failure is None for failure in outcomes.values())
     return {
-        tool_id: tool
-        for tool_id, tool in get_signed_out_tools().items()
-        if tool.signed_out and tool.holder_id == user_id
+        'success': succeeded == len(outcomes),
+        'message': f"{succeeded} of {len(outcomes)} tools {done}.",
+        'items': [
+            {
+                'tool_id': tool_id,
+                'success': failure is None,
+                'message': f"Tool {tool_id} {done}." if failure is None else f"Tool {tool_id} {failure.value}.",
+            }
+            for tool_id, failure in outcomes.items()
+        ],
     }
 
 
-def save_tool_picture():
-    if 'picture' not in request.files:
+def get_listing_args(sort_columns) -> Tuple[str, bool, Optional[str], int]:
+    """Sort column, direction, cursor and page size for a paginated listing, from the query string."""
+    sort = request.args.get('sort', 'name')
+    if sort not in sort_columns:
+        sort = 'name'
+    descending = request.args.get('order') == 'desc'
+    per_page = min(max(request.args.get('per_page', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    return sort, descending, request.args.get('after'), per_page
+
+
+def stage_tool_picture() -> Optional[StagedPicture]:
+    """Copy the uploaded picture, if there is one, to a temporary file to be published with PICTURES."""
+    picture = request.files.get('picture')
+    if picture is None or not picture.filename:
         return None
-    picture = request.files['picture']
-    if picture.filename:
-        filename = picture.filename
-        final_path = sanitize_path(TOOL_IMAGES_PATH, filename)
-        picture.save(final_path)
-        return final_path.relative_to(TOOL_IMAGES_PATH)
+    return PICTURES.stage(picture.stream, picture.filename)
 
 
 def sanitize_path(base_path, path, allow_subdirs:bool = False):
@@ -550,58 +1044,140 @@ def ensure_path_in_base(base_path, path, allow_subdirs:bool = False):
     return test_path
 
 
-def ensure_all_have_barcode(db: DB):
-    # Find all tools with a barcode
-    db.cursor.execute('''
-        SELECT barcode
-        FROM inventory 
-        WHERE barcode IS NOT NULL
-    ''')
-    tools_with_barcodes = db.cursor.fetchall()
-
-    for (barcode,) in tools_with_barcodes:
-        ensure_barcode(barcode)
+def make_picture_variants(picture: str):
+    """Make the thumbnail and display copies of a newly uploaded picture, so its first view doesn't wait for them."""
+    try:
+        make_variants(TOOL_IMAGES_PATH, picture)
+    except OSError as e:
+        app.logger.warning(f"Couldn't make variants of {picture}: {e}")
 
 
 def ensure_qr_code(barcode: str):
-    img_path = Path(TOOL_BARCODES_PATH) / f"qr_{barcode}.png"
-    if not img_path.exists():
-        app.logger.debug(
-            f"Generating QR code for barcode {barcode} and saving to {img_path}"
-        )
-        generate_qr_code(str(barcode), img_path)
+    """Queue the QR code image for a barcode to be rendered in the background, if it doesn't exist yet."""
+    schedule_label(LabelKind.QR, barcode)
 
 
 def ensure_barcode(barcode: str):
-    img_path = Path(TOOL_BARCODES_PATH) / f"bar_{barcode}.png"
-    if not img_path.exists():
-        app.logger.debug(
-            f"Generating barcode for barcode {barcode} and saving to {img_path}"
-        )
-        generate_barcode(str(barcode), img_path)
-
+    """Queue the barcode image for a barcode to be rendered in the background, if it doesn't exist yet."""
+    schedule_label(LabelKind.BARCODE, barcode)
 
-def safe_unlink_tool_image(tool_image: str):
-    if tool_image:
-        # Clean up old picture
-        sanitized_old_path = ensure_path_in_base(TOOL_IMAGES_PATH, TOOL_IMAGES_PATH / Path(tool_image))
-        sanitized_old_path.unlink()
-        app.logger.debug(f"Old picture deleted: {sanitized_old_path}")
 
-
-def main():
-    app.logger.level = logging.DEBUG
-
-    # Initialize database
+def schedule_label(kind: LabelKind, barcode: str):
+    """Queue a label after its barcode was committed. Failing to queue it doesn't undo the change: the label is
+    rendered when it is first requested instead."""
+    try:
+        if LABELS.schedule(kind, barcode) is not None:
+            app.logger.debug(f"Queued {kind.name.lower()} label for barcode {barcode} to be rendered into "
+                             f"{TOOL_BARCODES_PATH}")
+    except RuntimeError as e:
+        # e.g. BrokenProcessPool after a render worker died, or the renderer has been shut down
+        app.logger.warning(f"Couldn't queue the {kind.name.lower()} label for barcode {barcode}: {e}")
+
+
+def release_tool_image(tool_image: str) -> Optional[ReleasedPicture]:
+    """Move aside a picture that no tool refers to any more. Call inside the write transaction, then delete the
+    result with PICTURES.delete after committing, or PICTURES.restore it after rolling back."""
+    # Clean up old picture, unless another tool shares it
+    if not tool_image or not is_picture_name(tool_image):
+        return None
+    released = PICTURES.release(g.db, tool_image)
+    if released is not None:
+        app.logger.debug(f"Old picture released: {TOOL_IMAGES_PATH / tool_image}")
+    return released
+
+
+def shutdown():
+    """Write out queued loan events, stop the label workers and close pooled connections before the process exits."""
+    LOAN_LOG.close()
+    LABELS.shutdown()
+    DB_POOL.close_all()
+
+
+def warm_labels(db: DB, batch_size: int = 256) -> int:
+    """Render the label of every tool and user barcode that hasn't been rendered yet. Returns how many were rendered.
+
+    Barcodes are read a batch at a time, and each batch is rendered before the next is read, so neither the queue
+    of pending labels nor a read transaction grows with the inventory.
+    """
+    rendered = 0
+    for table, kind in (('inventory', LabelKind.BARCODE), ('users', LabelKind.QR)):
+        last_id = 0
+        while batch := db.conn.execute(f'SELECT id, barcode FROM {table} WHERE id > ? AND barcode IS NOT NULL '
+                                       'ORDER BY id LIMIT ?', (last_id, batch_size)).fetchall():
+            last_id = batch[-1][0]
+            # Barcodes that can't appear in a label's file name are never served as labels
+            futures = [LABELS.schedule(kind, barcode) for _, barcode in batch
+                       if parse_label_filename(label_filename(kind, barcode)) is not None]
+            futures = [future for future in futures if future is not None]
+            wait_for_futures(futures)
+            rendered += sum(1 for future in futures if future.exception() is None)
+    return rendered
+
+
+def start_label_warmup() -> subprocess.Popen:
+    """Run the warm-labels command in a separate process, so the server doesn't wait for it to start."""
+    return subprocess.Popen([sys.executable, str(Path(__file__).resolve()), 'warm-labels'])
+
+
+def main(argv: Optional[List[str]] = None):
+    global EVENT_STREAMS
+    parser = argparse.ArgumentParser(description='Tool Room Inventory server')
+    commands = parser.add_subparsers(dest='command')
+    dev_parser = commands.add_parser('dev', help='run the development server with the debugger and reloader '
+                                                 '(the default)')
+    serve_parser = commands.add_parser('serve', help='run the production server with several worker processes')
+    serve_parser.add_argument('--host', default='::1')
+    serve_parser.add_argument('--port', type=int, default=5000)
+    serve_parser.add_argument('--workers', type=int, default=default_workers(),
+                              help='worker processes (default: one per core)')
+    serve_parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                              help=f'request threads per worker (default: {DEFAULT_THREADS})')
+    for server_parser in (dev_parser, serve_parser):
+        server_parser.add_argument('--sample-data', action='store_true',
+                                   help='delete all data and start over with the sample data')
+        server_parser.add_argument('--warm-labels', action='store_true',
+                                   help='render missing label images in the background')
+    commands.add_parser('warm-labels', help='render the label images of every barcode that has none yet')
+    args = parser.parse_args((sys.argv[1:] if argv is None else argv) or ['dev'])
+
+    # The development server's reloader runs this again in a child process; the parent has done the setup already
+    if args.command == 'dev' and is_running_from_reloader():
+        app.logger.level = logging.DEBUG
+        app.run(host='::1', port=5000, debug=True)
+        return
+
+    # Initialize database. Migrations only run if it is out of date.
     DB_PATH.parent.mkdir(exist_ok=True)
-    # Initialize default users if they don't exist
     with DB(DB_PATH, auto_migrate=True) as db:
         db.self_test()
-        drop_all_data(db)
-        create_sample_data(db)
-        ensure_all_have_barcode(db)
+        if args.command == 'warm-labels':
+            if hasattr(os, 'nice'):
+                # Give way to the server
+                os.nice(10)
+            rendered = warm_labels(db)
+            LABELS.shutdown()
+            print(f'Rendered {rendered} labels.')
+            return
+        if args.sample_data:
+            drop_all_data(db)
+            create_sample_data(db)
+
+    if args.warm_labels:
+        start_label_warmup()
+
+    if args.command == 'serve':
+        app.logger.level = logging.INFO
+        # Every worker has its own label rendering pool; between them they shouldn't need more than one per core
+        LABELS.max_workers = max(1, default_workers() // args.workers)
+        EVENT_STREAMS = BoundedSemaphore(max_event_streams(args.threads))
+        # So that no request thread has to wait for a connection; event streams give theirs back
+        DB_POOL.max_size = args.threads
+        # The database was migrated above, once, and that connection is closed before the workers fork
+        serve(app, args.host, args.port, args.workers, args.threads, on_worker_exit=shutdown)
+    else:
+        app.logger.level = logging.DEBUG
+        app.run(host='::1', port=5000, debug=True)
 
-    app.run(host='::1', port=5000, debug=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,46 @@
+from threading import Lock
+from typing import Dict, Optional
+
+from server.db.barcode_allocator import BarcodeNamespace
+from server.db.db import DB
+
+
+def normalize_barcode(barcode) -> Optional[str]:
+    """The canonical form of a barcode, as stored in the database: text without surrounding whitespace, or None
+    for no barcode. Numbers (e.g. from the allocator) become their decimal text."""
+    if barcode is None:
+        return None
+    return str(barcode).strip() or None
+
+
+class BarcodeIndex:
+    """Process-wide map from canonical barcode to tool and user ids, for resolving scans without a query.
+
+    The maps are rebuilt from the tables' barcode indexes whenever the barcode generation (see
+    DB.barcode_generation) has moved on, so writes from any process are picked up and signing tools in and out
+    never invalidates them. A lookup costs one read of the generation counter plus a dict lookup.
+    """
+
+    def __init__(self):
+        self._generation: Optional[int] = None
+        self._ids: Dict[BarcodeNamespace, Dict[str, int]] = {}
+        self._lock = Lock()
+
+    def lookup(self, db: DB, namespace: BarcodeNamespace, barcode) -> Optional[int]:
+        """The id of the tool or user with the barcode, or None."""
+        barcode = normalize_barcode(barcode)
+        if barcode is None:
+            return None
+        return self._current(db)[namespace].get(barcode)
+
+    def _current(self, db: DB) -> Dict[BarcodeNamespace, Dict[str, int]]:
+        generation = db.barcode_generation()
+        with self._lock:
+            if generation != self._generation:
+                self._ids = {
+                    namespace: dict(db.conn.execute(
+                        f'SELECT barcode, id FROM {namespace.value} WHERE barcode IS NOT NULL').fetchall())
+                    for namespace in BarcodeNamespace
+                }
+                self._generation = generation
+            return self._ids
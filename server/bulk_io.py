@@ -0,0 +1,253 @@
+import csv
+import datetime
+from enum import Enum
+import io
+import json
+import sqlite3
+from typing import IO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from server.barcode_index import normalize_barcode
+from server.db.barcode_allocator import BarcodeAllocator, BarcodeNamespace
+from server.db.db import DB
+from server.tool import Tool
+
+IMPORT_CHUNK_SIZE = 1000
+EXPORT_BATCH_SIZE = 500
+
+
+class BulkFormat(Enum):
+    """File formats for bulk import and export, named by their file extension."""
+    CSV = 'csv'
+    JSONL = 'jsonl'
+
+    @property
+    def mimetype(self) -> str:
+        return 'text/csv' if self is BulkFormat.CSV else 'application/jsonl'
+
+
+def _text(value) -> Optional[str]:
+    if value is None or value == '':
+        return None
+    return str(value)
+
+
+def _required_text(value) -> str:
+    value = _text(value)
+    if value is None:
+        raise ValueError('missing value')
+    return value
+
+
+def _integer(value) -> Optional[int]:
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f'not a number: {value}')
+    return int(value)
+
+
+def _timestamp(value) -> Optional[str]:
+    value = _text(value)
+    if value is None:
+        return None
+    return Tool.parse_db_signed_out_since(value).isoformat()
+
+
+def _flag(default: bool) -> Callable:
+    def parse(value) -> bool:
+        if value is None or value == '':
+            return default
+        if isinstance(value, (bool, int)):
+            return bool(value)
+        value = str(value).strip().lower()
+        if value in ('1', 'true', 'yes', 'y'):
+            return True
+        if value in ('0', 'false', 'no', 'n'):
+            return False
+        raise ValueError(f'not a yes/no value: {value}')
+    return parse
+
+
+def _check_loan(row: Dict):
+    """A tool is signed out exactly when it has a holder, and then always has a signed_out_since."""
+    if row['signed_out']:
+        if row['holder_id'] is None:
+            raise ValueError('a signed out tool needs a holder_id')
+        if row['signed_out_since'] is None:
+            row['signed_out_since'] = datetime.datetime.now().isoformat()
+    elif row['holder_id'] is not None or row['signed_out_since'] is not None:
+        raise ValueError('a tool that is not signed out can\'t have a holder_id or signed_out_since')
+
+
+class BulkTable:
+    """A table that can be bulk imported and exported: its columns in file order, how to read each column
+    from a file, and the namespace its barcodes are allocated from. check, if given, validates a parsed row
+    as a whole (as a dict by column) and may fill in values, raising ValueError if the row is inconsistent."""
+
+    def __init__(self, table: str, columns: Dict[str, Callable], namespace: BarcodeNamespace,
+                 check: Optional[Callable[[Dict], None]] = None):
+        self.table = table
+        self.columns = columns
+        self.namespace = namespace
+        self.check = check
+        self.barcode_index = list(columns).index('barcode')
+        self.insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    def parse(self, record: Dict) -> List:
+        """Column values for a record read from a file. Columns missing from the record get their defaults."""
+        if not isinstance(record, dict):
+            raise ValueError('not an object')
+        row = {}
+        for column, parse in self.columns.items():
+            try:
+                row[column] = parse(record.get(column))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f'{column}: {e}') from None
+        if self.check is not None:
+            self.check(row)
+        return list(row.values())
+
+
+TABLES = {
+    'tools': BulkTable('inventory', {
+        'id': _integer,
+        'name': _required_text,
+        'barcode': normalize_barcode,
+        'description': _text,
+        'picture': _text,
+        'signed_out': _flag(False),
+        'holder_id': _integer,
+        'signed_out_since': _timestamp,
+    }, BarcodeNamespace.TOOLS, check=_check_loan),
+    'users': BulkTable('users', {
+        'id': _integer,
+        'name': _required_text,
+        'barcode': normalize_barcode,
+        'is_admin': _flag(False),
+        'is_user': _flag(True),
+    }, BarcodeNamespace.USERS),
+}
+
+
+class ImportReport:
+    """Outcome of a bulk import: how many rows were added, and why the others were not."""
+
+    def __init__(self):
+        self.imported = 0
+        self.errors: List[Tuple[int, str]] = []
+
+    def summary(self, max_errors: int = 5) -> str:
+        message = f'Imported {self.imported} rows'
+        if not self.errors:
+            return message + '.'
+        details = '; '.join(f'line {line}: {error}' for line, error in self.errors[:max_errors])
+        more = f' (and {len(self.errors) - max_errors} more)' if len(self.errors) > max_errors else ''
+        return f'{message}, skipped {len(self.errors)}: {details}{more}.'
+
+
+def export_rows(db: DB, table: BulkTable, fmt: BulkFormat) -> Iterator[str]:
+    """Stream a table as CSV or JSON lines, reading it from a cursor in batches of EXPORT_BATCH_SIZE rows."""
+    columns = list(table.columns)
+    cursor = db.conn.execute(f"SELECT {', '.join(columns)} FROM {table.table} ORDER BY id")
+    try:
+        if fmt is BulkFormat.CSV:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            while rows := cursor.fetchmany(EXPORT_BATCH_SIZE):
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            while rows := cursor.fetchmany(EXPORT_BATCH_SIZE):
+                yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+    finally:
+        cursor.close()
+
+
+def import_rows(db: DB, table: BulkTable, stream: IO[bytes], fmt: BulkFormat,
+                allocate_barcodes: bool = False) -> ImportReport:
+    """Add the rows of a CSV or JSON lines file to a table, reading the file as it goes.
+
+    Rows are inserted with executemany in transactions of IMPORT_CHUNK_SIZE rows. If a chunk hits a constraint
+    (a barcode or id that is already taken, a holder that doesn't exist) it is retried row by row so that only
+    the offending rows are skipped. Barcodes in the file are claimed from the allocator, and rows without one
+    get a new barcode if allocate_barcodes is set. Label images are not rendered here; they are rendered when
+    first requested.
+    """
+    report = ImportReport()
+    chunk: List[Tuple[int, List]] = []
+    for line, record in _records(stream, fmt):
+        try:
+            if isinstance(record, str):
+                record = json.loads(record)
+            chunk.append((line, table.parse(record)))
+        except ValueError as e:
+            report.errors.append((line, str(e)))
+            continue
+        if len(chunk) == IMPORT_CHUNK_SIZE:
+            _import_chunk(db, table, chunk, allocate_barcodes, report)
+            chunk = []
+    if chunk:
+        _import_chunk(db, table, chunk, allocate_barcodes, report)
+    return report
+
+
+def _records(stream: IO[bytes], fmt: BulkFormat) -> Iterator[Tuple[int, object]]:
+    """(line number, record) for each record of the file. JSON lines are left for the caller to decode."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt is BulkFormat.CSV:
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line, record in enumerate(text, 1):
+            if record.strip():
+                yield line, record
+
+
+def _import_chunk(db: DB, table: BulkTable, chunk: List[Tuple[int, List]], allocate_barcodes: bool,
+                  report: ImportReport):
+    try:
+        db.cursor.execute('BEGIN IMMEDIATE TRANSACTION')
+        db.cursor.executemany(table.insert, _with_barcodes(db, table, chunk, allocate_barcodes))
+        db.conn.commit()
+        report.imported += len(chunk)
+        return
+    except sqlite3.IntegrityError:
+        db.conn.rollback()
+
+    db.cursor.execute('BEGIN IMMEDIATE TRANSACTION')
+    for line, values in chunk:
+        db.cursor.execute('SAVEPOINT import_row')
+        try:
+            db.cursor.execute(table.insert, _with_barcodes(db, table, [(line, values)], allocate_barcodes)[0])
+            db.cursor.execute('RELEASE import_row')
+            report.imported += 1
+        except sqlite3.IntegrityError as e:
+            db.cursor.execute('ROLLBACK TO import_row')
+            db.cursor.execute('RELEASE import_row')
+            report.errors.append((line, str(e)))
+    db.conn.commit()
+
+
+def _with_barcodes(db: DB, table: BulkTable, chunk: List[Tuple[int, List]], allocate_barcodes: bool) -> List:
+    """The chunk's rows with barcodes claimed from, or allocated by, the table's barcode allocator."""
+    allocator = BarcodeAllocator(db, table.namespace)
+    index = table.barcode_index
+    given = {values[index] for _, values in chunk if values[index] is not None}
+    rows = []
+    for _, values in chunk:
+        values = list(values)
+        if values[index] is not None:
+            allocator.claim(values[index])
+        elif allocate_barcodes:
+            # Skip numbers that rows later in this chunk are about to take
+            while (barcode := str(allocator.allocate())) in given:
+                pass
+            values[index] = barcode
+        rows.append(values)
+    return rows
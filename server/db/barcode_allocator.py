@@ -0,0 +1,86 @@
+from enum import Enum
+from typing import Optional
+
+from server.db.db import DB
+
+
+class BarcodeNamespace(Enum):
+    """Independent barcode number spaces, named after the table that stores the barcodes."""
+    TOOLS = 'inventory'
+    USERS = 'users'
+
+
+class BarcodeAllocator:
+    """Hands out the lowest free numeric barcode in a namespace.
+
+    Numbers that have never been handed out are represented by next_value in barcode_sequences, and
+    numbers below it that have been given back are kept in barcode_free_list, so every operation is a
+    few primary key or index lookups rather than a scan of the table. Barcodes that were typed in by
+    hand are skipped when the sequence reaches them.
+
+    Call from inside the write transaction (BEGIN IMMEDIATE) that stores or clears the barcode, so the
+    allocation commits or rolls back together with it.
+    """
+
+    def __init__(self, db: DB, namespace: BarcodeNamespace):
+        self.db = db
+        self.namespace = namespace
+
+    def allocate(self) -> int:
+        """Allocate the lowest barcode that is not in use."""
+        cursor = self.db.cursor
+        self._ensure_sequence()
+        while True:
+            cursor.execute('''
+                DELETE FROM barcode_free_list
+                WHERE namespace = ? AND value = (SELECT MIN(value) FROM barcode_free_list WHERE namespace = ?)
+                RETURNING value
+            ''', (self.namespace.value, self.namespace.value))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute('''
+                    UPDATE barcode_sequences SET next_value = next_value + 1
+                    WHERE namespace = ?
+                    RETURNING next_value - 1
+                ''', (self.namespace.value,))
+                row = cursor.fetchone()
+            value = row[0]
+            if not self._in_use(value):
+                return value
+
+    def claim(self, barcode):
+        """Record that a barcode was assigned by hand, so it is not handed out again."""
+        value = self._as_number(barcode)
+        if value is not None:
+            self.db.cursor.execute('DELETE FROM barcode_free_list WHERE namespace = ? AND value = ?',
+                                   (self.namespace.value, value))
+
+    def release(self, barcode):
+        """Give a barcode that is no longer assigned back to the allocator."""
+        value = self._as_number(barcode)
+        if value is None:
+            return
+        self._ensure_sequence()
+        # Numbers at or above next_value are handed out by the sequence anyway
+        self.db.cursor.execute('''
+            INSERT OR IGNORE INTO barcode_free_list (namespace, value)
+            SELECT namespace, ? FROM barcode_sequences WHERE namespace = ? AND next_value > ?
+        ''', (value, self.namespace.value, value))
+
+    def _ensure_sequence(self):
+        self.db.cursor.execute('INSERT OR IGNORE INTO barcode_sequences (namespace, next_value) VALUES (?, 1)',
+                               (self.namespace.value,))
+
+    def _in_use(self, value: int) -> bool:
+        self.db.cursor.execute(f'SELECT 1 FROM {self.namespace.value} WHERE barcode = ?', (str(value),))
+        return self.db.cursor.fetchone() is not None
+
+    @staticmethod
+    def _as_number(barcode) -> Optional[int]:
+        """The barcode as a number if it is one the allocator could have handed out, otherwise None."""
+        if barcode is None:
+            return None
+        barcode = str(barcode)
+        if not (barcode.isascii() and barcode.isdigit()) or barcode.startswith('0'):
+            return None
+        return int(barcode)
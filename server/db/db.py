@@ -1,8 +1,10 @@
+from contextlib import contextmanager
 from enum import Enum
 from os import PathLike
 import sqlite3
-from typing import List, Dict, Self, Optional, ClassVar
-from threading import Lock
+import time
+from typing import List, Dict, Self, Optional, ClassVar, Iterator
+from threading import Lock, Condition
 
 from server.db.meta_props import MetaProps
 
@@ -33,16 +35,162 @@ class DB:
             holder_id INTEGER,
             signed_out_since TEXT,
             FOREIGN KEY (holder_id) REFERENCES users(id)
-        )'''
+        )''',
+
+        # Barcodes must be unique within a table, but any number of rows may have none
+        '''CREATE UNIQUE INDEX IF NOT EXISTS inventory_barcode ON inventory(barcode) WHERE barcode IS NOT NULL''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS users_barcode ON users(barcode) WHERE barcode IS NOT NULL''',
+
+        # Signed out filters and "tools held by a user"
+        '''CREATE INDEX IF NOT EXISTS inventory_signed_out_holder ON inventory(signed_out, holder_id)''',
+        '''CREATE INDEX IF NOT EXISTS inventory_signed_out_since ON inventory(signed_out_since)''',
+
+        # Barcode allocator state, see server/db/barcode_allocator.py
+        '''CREATE TABLE IF NOT EXISTS barcode_sequences (
+            namespace TEXT PRIMARY KEY NOT NULL,
+            next_value INTEGER NOT NULL
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS barcode_free_list (
+            namespace TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (namespace, value)
+        ) WITHOUT ROWID''',
+
+        # Sort orders for the paginated listings, see server/db/repository.py
+        '''CREATE INDEX IF NOT EXISTS inventory_name ON inventory(name)''',
+        '''CREATE INDEX IF NOT EXISTS inventory_barcode_sort ON inventory(IFNULL(barcode, ''))''',
+        '''CREATE INDEX IF NOT EXISTS inventory_signed_out_since_sort ON inventory(IFNULL(signed_out_since, ''))''',
+        '''CREATE INDEX IF NOT EXISTS users_name ON users(name)''',
+        '''CREATE INDEX IF NOT EXISTS users_barcode_sort ON users(IFNULL(barcode, ''))''',
+
+        # Change counter for caches, bumped on every write to users or inventory. See DB.data_generation
+        '''INSERT OR IGNORE INTO db_meta_props (name, value) VALUES ('data_generation', 0)''',
+        '''CREATE TRIGGER IF NOT EXISTS users_insert_data_generation AFTER INSERT ON users BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'data_generation';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS users_update_data_generation AFTER UPDATE ON users BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'data_generation';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS users_delete_data_generation AFTER DELETE ON users BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'data_generation';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS inventory_insert_data_generation AFTER INSERT ON inventory BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'data_generation';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS inventory_update_data_generation AFTER UPDATE ON inventory BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'data_generation';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS inventory_delete_data_generation AFTER DELETE ON inventory BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'data_generation';
+        END''',
+
+        # Append-only history of sign outs and returns, written by server.loan_log.LoanLog. No foreign keys, so
+        # the history outlives deleted tools and users.
+        '''CREATE TABLE IF NOT EXISTS loan_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            tool_id INTEGER NOT NULL,
+            user_id INTEGER,
+            event TEXT NOT NULL,
+            at TEXT NOT NULL
+        )''',
+        '''CREATE INDEX IF NOT EXISTS loan_events_tool ON loan_events(tool_id, id)''',
+        # Events land shortly after the change they record, so cached pages showing history must be refreshed
+        '''CREATE TRIGGER IF NOT EXISTS loan_events_insert_data_generation AFTER INSERT ON loan_events BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'data_generation';
+        END''',
+
+        # Barcodes are stored in canonical form (see server.barcode_index.normalize_barcode): text without
+        # surrounding whitespace, and NULL rather than empty. Rows whose canonical barcode is taken keep theirs.
+        '''UPDATE OR IGNORE inventory SET barcode = NULLIF(TRIM(CAST(barcode AS TEXT)), '')
+        WHERE barcode IS NOT NULL AND (typeof(barcode) != 'text' OR barcode = '' OR barcode != TRIM(barcode))''',
+        '''UPDATE OR IGNORE users SET barcode = NULLIF(TRIM(CAST(barcode AS TEXT)), '')
+        WHERE barcode IS NOT NULL AND (typeof(barcode) != 'text' OR barcode = '' OR barcode != TRIM(barcode))''',
+
+        # Change counter for the in-memory barcode index, bumped only when a barcode is added, changed or removed.
+        # See DB.barcode_generation
+        '''INSERT OR IGNORE INTO db_meta_props (name, value) VALUES ('barcode_generation', 0)''',
+        '''CREATE TRIGGER IF NOT EXISTS inventory_insert_barcode_generation AFTER INSERT ON inventory
+        WHEN NEW.barcode IS NOT NULL BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'barcode_generation';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS inventory_update_barcode_generation AFTER UPDATE OF barcode ON inventory
+        WHEN OLD.barcode IS NOT NEW.barcode BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'barcode_generation';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS inventory_delete_barcode_generation AFTER DELETE ON inventory
+        WHEN OLD.barcode IS NOT NULL BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'barcode_generation';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS users_insert_barcode_generation AFTER INSERT ON users
+        WHEN NEW.barcode IS NOT NULL BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'barcode_generation';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS users_update_barcode_generation AFTER UPDATE OF barcode ON users
+        WHEN OLD.barcode IS NOT NEW.barcode BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'barcode_generation';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS users_delete_barcode_generation AFTER DELETE ON users
+        WHEN OLD.barcode IS NOT NULL BEGIN
+            UPDATE db_meta_props SET value = value + 1 WHERE name = 'barcode_generation';
+        END''',
+
+        # Full text index over tool names and descriptions for search, reading the text from inventory itself.
+        # Prefix indexes make short typeahead prefixes cheap.
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS inventory_fts USING fts5(
+            name, description,
+            content='inventory', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS inventory_fts_insert AFTER INSERT ON inventory BEGIN
+            INSERT INTO inventory_fts (rowid, name, description) VALUES (NEW.id, NEW.name, NEW.description);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS inventory_fts_delete AFTER DELETE ON inventory BEGIN
+            INSERT INTO inventory_fts (inventory_fts, rowid, name, description)
+            VALUES ('delete', OLD.id, OLD.name, OLD.description);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS inventory_fts_update AFTER UPDATE OF name, description ON inventory BEGIN
+            INSERT INTO inventory_fts (inventory_fts, rowid, name, description)
+            VALUES ('delete', OLD.id, OLD.name, OLD.description);
+            INSERT INTO inventory_fts (rowid, name, description) VALUES (NEW.id, NEW.name, NEW.description);
+        END''',
+        '''INSERT INTO inventory_fts (inventory_fts) VALUES ('rebuild')''',
+
+        # Reference counts for shared, content addressed tool pictures. See server.pictures.PictureStore
+        '''CREATE INDEX IF NOT EXISTS inventory_picture ON inventory(picture) WHERE picture IS NOT NULL''',
+
+        # Tools whose dashboard row changed, in commit order, followed by open dashboards. See server.tool_feed.
+        # Only the most recent changes are kept; a dashboard that falls further behind reloads instead.
+        '''CREATE TABLE IF NOT EXISTS tool_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tool_id INTEGER NOT NULL
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS tool_changes_prune AFTER INSERT ON tool_changes BEGIN
+            DELETE FROM tool_changes WHERE id <= NEW.id - 1024;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS tool_changes_insert AFTER INSERT ON inventory BEGIN
+            INSERT INTO tool_changes (tool_id) VALUES (NEW.id);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS tool_changes_update
+        AFTER UPDATE OF name, description, barcode, signed_out, holder_id ON inventory BEGIN
+            INSERT INTO tool_changes (tool_id) VALUES (NEW.id);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS tool_changes_delete AFTER DELETE ON inventory BEGIN
+            INSERT INTO tool_changes (tool_id) VALUES (OLD.id);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS tool_changes_holder_rename AFTER UPDATE OF name ON users
+        WHEN NEW.name IS NOT OLD.name BEGIN
+            INSERT INTO tool_changes (tool_id) SELECT id FROM inventory WHERE signed_out = 1 AND holder_id = NEW.id;
+        END''',
     ]
     VERSION = len(_MIGRATIONS)
     _cached_db_version: ClassVar[Dict[str, int]] = {}
     _version_lock: ClassVar[Lock] = Lock()
     _migration_lock: ClassVar[Lock] = Lock()  # Singleton lock for migrations
 
-    def __init__(self, filename: str | bytes | PathLike[str], auto_migrate=False):
+    def __init__(self, filename: str | bytes | PathLike[str], auto_migrate=False, check_same_thread=True):
         """Initialize database connection and handle migrations if needed."""
         self.filename = filename
+        self.check_same_thread = check_same_thread
         self.conn: Optional[sqlite3.Connection] = None
         self.cursor: Optional[sqlite3.Cursor] = None
         
@@ -74,7 +222,7 @@ class DB:
         """Create a new connection with appropriate settings."""
         if self.conn:
             return
-        self.conn = sqlite3.connect(self.filename)
+        self.conn = sqlite3.connect(self.filename, check_same_thread=self.check_same_thread)
         self.cursor = self.conn.cursor()
         
         # Set pragmas for better performance and safety
@@ -103,6 +251,16 @@ class DB:
         if self.cursor.fetchone()[0] != 1:
             raise RuntimeError('Self-test failed: Unexpected database response.')
 
+    def data_generation(self) -> int:
+        """Counter that is bumped (by triggers) whenever users or inventory change, in any process."""
+        self.cursor.execute('SELECT value FROM db_meta_props WHERE name = ?', [MetaProps.DATA_GENERATION.value])
+        return int(self.cursor.fetchone()[0])
+
+    def barcode_generation(self) -> int:
+        """Counter that is bumped (by triggers) whenever a tool or user barcode is added, changed or removed."""
+        self.cursor.execute('SELECT value FROM db_meta_props WHERE name = ?', [MetaProps.BARCODE_GENERATION.value])
+        return int(self.cursor.fetchone()[0])
+
     def _get_db_version(self) -> int:
         """Get the current database version, using cached value if available."""
         # Check if we have a cached version
@@ -169,3 +327,127 @@ class DB:
         """Reset the cached database version. Useful for testing."""
         with cls._version_lock:
             cls._cached_db_version = {}
+
+
+class DBPool:
+    """Pool of warm DB connections shared between request threads.
+
+    Connections are opened lazily up to max_size, so the connect and pragma setup in DB.connect only
+    happens once per connection rather than once per request. Idle connections are health-checked with
+    DB.self_test on checkout and replaced if they have gone bad. A connection is only ever held by one
+    thread at a time, but may be handed to a different thread on its next checkout.
+    """
+
+    def __init__(self, filename: str | bytes | PathLike[str], max_size: int = 8,
+                 checkout_timeout: float = 10.0, auto_migrate=False):
+        self.filename = filename
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.auto_migrate = auto_migrate
+        self._idle: List[DB] = []
+        self._size = 0
+        self._available = Condition(Lock())
+        self._checkouts = 0
+        self._waits = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._replaced = 0
+
+    def acquire(self) -> DB:
+        """Check out a connection, waiting up to checkout_timeout for one to become free."""
+        start = time.perf_counter()
+        deadline = start + self.checkout_timeout
+        with self._available:
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise TimeoutError(f'Timed out waiting for a database connection ({self.max_size} in use).')
+                self._available.wait(remaining)
+            db = self._idle.pop() if self._idle else None
+            if db is None:
+                # Reserve the slot now; the connection itself is opened outside the lock
+                self._size += 1
+            wait = time.perf_counter() - start
+            self._checkouts += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            if wait > 0.001:
+                self._waits += 1
+
+        if db is not None:
+            try:
+                db.self_test()
+                return db
+            except (sqlite3.Error, RuntimeError):
+                self._discard(db)
+                with self._available:
+                    self._size += 1
+                    self._replaced += 1
+        try:
+            return DB(self.filename, auto_migrate=self.auto_migrate, check_same_thread=False)
+        except Exception:
+            with self._available:
+                self._size -= 1
+                self._available.notify()
+            raise
+
+    def release(self, db: DB, rollback=False):
+        """Return a connection to the pool, committing (or rolling back) any open transaction."""
+        try:
+            if db.conn is None:
+                raise sqlite3.ProgrammingError('Connection was closed while checked out.')
+            if rollback:
+                db.conn.rollback()
+            else:
+                db.conn.commit()
+        except sqlite3.Error:
+            self._discard(db)
+            with self._available:
+                self._available.notify()
+            return
+        with self._available:
+            self._idle.append(db)
+            self._available.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[DB]:
+        """Check out a connection for the duration of a with block."""
+        db = self.acquire()
+        try:
+            yield db
+        except BaseException:
+            self.release(db, rollback=True)
+            raise
+        self.release(db)
+
+    def close_all(self):
+        """Close every idle connection, e.g. on shutdown."""
+        with self._available:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for db in idle:
+            db.close()
+
+    def stats(self) -> Dict[str, float]:
+        """Pool size and checkout-wait metrics."""
+        with self._available:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'checkouts': self._checkouts,
+                'waited_checkouts': self._waits,
+                'total_wait_seconds': self._total_wait,
+                'max_wait_seconds': self._max_wait,
+                'replaced_connections': self._replaced,
+            }
+
+    def _discard(self, db: DB):
+        """Drop a connection that can no longer be used and free its slot."""
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+        with self._available:
+            self._size -= 1
@@ -17,6 +17,9 @@ def drop_all_data(db_instance: DB):
     # Deleting data from tables
     cursor.execute("DELETE FROM inventory;")
     cursor.execute("DELETE FROM users;")
+    cursor.execute("DELETE FROM barcode_free_list;")
+    cursor.execute("DELETE FROM barcode_sequences;")
+    cursor.execute("DELETE FROM loan_events;")
 
     # Commit the changes
     db_instance.conn.commit()
@@ -36,7 +39,7 @@ def create_sample_data(db_instance: DB):
     cursor.execute('SELECT COUNT(*) FROM users')
     if cursor.fetchone()[0] == 0:
         users = [
-            ('Hugo', 2, True, True),
+            ('Hugo', '2', True, True),
             ('Jake', None, False, True),
             ('Adam', '53', True, True),
         ]
@@ -56,7 +59,7 @@ def create_sample_data(db_instance: DB):
             ('Metric hex keys', '3', 'Metric lmao', None, True, user_ids[1], datetime.datetime.now(tz=datetime.timezone.utc)),
             ('Imperial hex keys', '5', 'Imperial lmao', None, True, user_ids[2], datetime.datetime.now(tz=datetime.timezone.utc)),
             ('Drill bits 1', None, 'Drill bits', None, False, None, None),
-            ('Drill bits 2', 69, 'Drill bits', None, False, None, None),
+            ('Drill bits 2', '69', 'Drill bits', None, False, None, None),
         ]
         for tool in tools:
             cursor.execute(
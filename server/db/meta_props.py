@@ -3,4 +3,6 @@ from enum import Enum
 
 class MetaProps(Enum):
     """Enumeration of metadata properties stored in the db_meta_props table."""
-    DB_VERSION = 'db_version' 
\ No newline at end of file
+    DB_VERSION = 'db_version' 
+    DATA_GENERATION = 'data_generation'
+    BARCODE_GENERATION = 'barcode_generation'
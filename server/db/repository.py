@@ -0,0 +1,229 @@
+import base64
+import binascii
+import json
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from server.db.db import DB
+from server.loan_log import LoanEvent, LoanEventKind
+from server.tool import Tool
+from server.user import User
+
+
+class Page:
+    """One page of a keyset-paginated listing, keyed by id in display order."""
+
+    def __init__(self, items: Dict, next_cursor: Optional[str]):
+        self.items = items
+        self.next_cursor = next_cursor
+
+
+class PageStream:
+    """One page of a keyset-paginated listing, hydrated lazily from a database cursor as it is iterated.
+
+    Iterating yields (id, item) pairs in display order, so a template can render rows as they are read
+    without the page ever being held in memory. next_cursor is only known once iteration has finished.
+    Can only be iterated once.
+    """
+
+    def __init__(self, rows: Iterator, limit: int, from_row: Callable, sort_key_index: int):
+        self._rows = rows
+        self._limit = limit
+        self._from_row = from_row
+        self._sort_key_index = sort_key_index
+        self.next_cursor: Optional[str] = None
+
+    def __iter__(self):
+        count, last_row = 0, None
+        try:
+            for row in self._rows:
+                if count == self._limit:
+                    self.next_cursor = encode_cursor(last_row[self._sort_key_index], last_row[0])
+                    break
+                yield row[0], self._from_row(row)
+                count, last_row = count + 1, row
+        finally:
+            self._rows.close()
+
+
+def encode_cursor(sort_value, row_id: int) -> str:
+    """Encode the sort key of the last row on a page as an opaque cursor for the next one."""
+    return base64.urlsafe_b64encode(json.dumps([sort_value, row_id]).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Decode a cursor made by encode_cursor, or return None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        return None
+    if not isinstance(sort_value, str) or not isinstance(row_id, int):
+        return None
+    return sort_value, row_id
+
+
+def _keyset_clause(sort_expr: str, id_col: str, after: Optional[str], descending: bool,
+                   limit: int) -> Tuple[str, Tuple]:
+    """WHERE/ORDER BY/LIMIT for the page after the given cursor. Fetches one extra row to detect a next page.
+
+    Every sort expression has an index (see DB._MIGRATIONS), so the cost of a page doesn't depend on how
+    far into the listing it is.
+    """
+    direction, comparison = ('DESC', '<') if descending else ('ASC', '>')
+    where, params = '', ()
+    key = decode_cursor(after)
+    if key is not None:
+        # Equivalent to ({sort_expr}, {id_col}) > (?, ?), but spelled out so that SQLite can seek on
+        # expression indexes, which it won't do for row value comparisons
+        where = f'WHERE {sort_expr} {comparison}= ? AND ({sort_expr} {comparison} ? OR {id_col} {comparison} ?)'
+        params = (key[0], key[0], key[1])
+    return f'{where} ORDER BY {sort_expr} {direction}, {id_col} {direction} LIMIT ?', params + (limit + 1,)
+
+
+_SEARCH_TERM = re.compile(r'\w+')
+
+
+def search_expression(query: str) -> Optional[str]:
+    """FTS5 match expression for a search box query: every word must match, the last one as a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation in the query are matched as text rather than parsed.
+    """
+    terms = _SEARCH_TERM.findall(query)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+
+
+class ToolRepository:
+    """Inventory queries for the views, filtered in SQL with the holder's name joined in from users."""
+
+    _COLUMNS = f"{', '.join(f'inventory.{col}' for col in Tool.default_projection())}, users.name"
+    _FROM = 'FROM inventory LEFT JOIN users ON users.id = inventory.holder_id'
+    _SELECT = f'SELECT {_COLUMNS} {_FROM}'
+
+    # Sort orders for the paginated listing. NULLs are folded into '' to keep keyset comparisons simple.
+    SORT_COLUMNS = {
+        'name': 'inventory.name',
+        'barcode': "IFNULL(inventory.barcode, '')",
+        'signed_out_since': "IFNULL(inventory.signed_out_since, '')",
+    }
+
+    def __init__(self, db: DB):
+        self.db = db
+
+    def get(self, tool_id: int) -> Optional[Tool]:
+        """Look up a single tool (and its holder's name) by primary key."""
+        return self._fetch('WHERE inventory.id = ?', (tool_id,)).get(tool_id)
+
+    def get_many(self, tool_ids: Iterable[int]) -> Dict[int, Tool]:
+        """Look up tools by primary key in a single query. Ids with no tool are left out."""
+        return self._fetch('WHERE inventory.id IN (SELECT value FROM json_each(?))', (json.dumps(list(tool_ids)),))
+
+    def dashboard(self) -> Tuple[Dict[int, Tool], Dict[int, Tool]]:
+        """Available and signed out tools, split from a single query."""
+        available, signed_out = {}, {}
+        for tool_id, tool in self._fetch('ORDER BY inventory.id').items():
+            (signed_out if tool.signed_out else available)[tool_id] = tool
+        return available, signed_out
+
+    def page(self, sort: str = 'name', after: Optional[str] = None, limit: int = 50,
+             descending: bool = False) -> Page:
+        """A page of tools in the given sort order, starting after the cursor."""
+        stream = self.stream_page(sort, after, limit, descending)
+        return Page(dict(stream), stream.next_cursor)
+
+    def stream_page(self, sort: str = 'name', after: Optional[str] = None, limit: int = 50,
+                    descending: bool = False) -> PageStream:
+        """Like page, but reads the tools from the database as the page is iterated."""
+        sort_expr = self.SORT_COLUMNS[sort]
+        clause, params = _keyset_clause(sort_expr, 'inventory.id', after, descending, limit)
+        cursor = self.db.conn.execute(f'SELECT {self._COLUMNS}, {sort_expr} {self._FROM} {clause}', params)
+        return PageStream(cursor, limit, self._from_row, 9)
+
+    def search(self, query: str, after: Optional[str] = None, limit: int = 20) -> Page:
+        """Tools matching a search box query, best matches (on name, then description) first.
+
+        Relevance isn't a stable sort key, so pages are addressed by offset. The cursor is still opaque.
+        """
+        expression = search_expression(query)
+        if expression is None:
+            return Page({}, None)
+        offset = decode_cursor(after)
+        offset = offset[1] if offset is not None else 0
+        cursor = self.db.conn.execute(f'''
+            SELECT {self._COLUMNS} {self._FROM}
+            JOIN inventory_fts ON inventory_fts.rowid = inventory.id
+            WHERE inventory_fts MATCH ?
+            ORDER BY bm25(inventory_fts, 10.0, 1.0), inventory.id
+            LIMIT ? OFFSET ?
+        ''', (expression, limit + 1, offset))
+        tools = {}
+        for row in cursor:
+            if len(tools) == limit:
+                return Page(tools, encode_cursor('', offset + limit))
+            tool = self._from_row(row)
+            tools[tool.tool_id] = tool
+        return Page(tools, None)
+
+    def history(self, tool_id: int, limit: int = 20) -> List[LoanEvent]:
+        """The most recent loan events for a tool, newest first."""
+        cursor = self.db.conn.execute('''
+            SELECT loan_events.tool_id, loan_events.user_id, users.name, loan_events.event, loan_events.at
+            FROM loan_events LEFT JOIN users ON users.id = loan_events.user_id
+            WHERE loan_events.tool_id = ?
+            ORDER BY loan_events.id DESC
+            LIMIT ?
+        ''', (tool_id, limit))
+        return [LoanEvent(row[0], row[1], row[2], LoanEventKind(row[3]), row[4]) for row in cursor]
+
+    def _fetch(self, clause: str, params: Tuple = ()) -> Dict[int, Tool]:
+        cursor = self.db.conn.execute(f'{self._SELECT} {clause}', params)
+        tools = {}
+        for row in cursor:
+            tool = self._from_row(row)
+            tools[tool.tool_id] = tool
+        return tools
+
+    @staticmethod
+    def _from_row(row) -> Tool:
+        tool = Tool.from_row(row)
+        tool.holder_name = row[8]
+        return tool
+
+
+class UserRepository:
+    """User queries for the views."""
+
+    _SELECT = f'SELECT {', '.join(User.default_projection())} FROM users'
+
+    SORT_COLUMNS = {
+        'name': 'name',
+        'barcode': "IFNULL(barcode, '')",
+    }
+
+    def __init__(self, db: DB):
+        self.db = db
+
+    def get(self, user_id: int) -> Optional[User]:
+        """Look up a single user by primary key."""
+        row = self.db.conn.execute(f'{self._SELECT} WHERE id = ?', (user_id,)).fetchone()
+        if row is None:
+            return None
+        return User.from_row(row)
+
+    def page(self, sort: str = 'name', after: Optional[str] = None, limit: int = 50,
+             descending: bool = False) -> Page:
+        """A page of users in the given sort order, starting after the cursor."""
+        stream = self.stream_page(sort, after, limit, descending)
+        return Page(dict(stream), stream.next_cursor)
+
+    def stream_page(self, sort: str = 'name', after: Optional[str] = None, limit: int = 50,
+                    descending: bool = False) -> PageStream:
+        """Like page, but reads the users from the database as the page is iterated."""
+        sort_expr = self.SORT_COLUMNS[sort]
+        clause, params = _keyset_clause(sort_expr, 'id', after, descending, limit)
+        cursor = self.db.conn.execute(
+            f'SELECT {', '.join(User.default_projection())}, {sort_expr} FROM users {clause}', params)
+        return PageStream(cursor, limit, User.from_row, 5)
@@ -0,0 +1,165 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from enum import Enum
+import importlib
+import multiprocessing
+import os
+from pathlib import Path
+import re
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple
+
+
+class LabelKind(Enum):
+    """Kinds of printable label, named by the prefix of their image file."""
+    BARCODE = 'bar'
+    QR = 'qr'
+
+
+# Module and function that draw each kind of label into a PNG file, given the code and the file name. They pull in
+# qrcode, python-barcode and Pillow, which take longer to import than the rest of the app put together, so they are
+# only imported once a process actually renders a label.
+_BACKENDS = {
+    LabelKind.BARCODE: ('server.barcodes', 'generate_barcode'),
+    LabelKind.QR: ('server.qr', 'generate_qr_code'),
+}
+
+
+def label_backend(kind: LabelKind) -> Callable[[str, Path], None]:
+    """The function that draws labels of the given kind, importing it on first use."""
+    module, function = _BACKENDS[kind]
+    return getattr(importlib.import_module(module), function)
+
+
+_LABEL_NAME = re.compile(r'^(bar|qr)_([0-9A-Za-z-]{1,64})\.png$')
+
+
+def label_filename(kind: LabelKind, code) -> str:
+    return f"{kind.value}_{code}.png"
+
+
+def parse_label_filename(name: str) -> Optional[Tuple[LabelKind, str]]:
+    """Split a label image file name into its kind and code, or return None if it isn't one."""
+    match = _LABEL_NAME.match(name)
+    if match is None:
+        return None
+    return LabelKind(match.group(1)), match.group(2)
+
+
+def render_label(kind: str, code: str, filename: Path):
+    """Render a label image to filename. Runs in a worker process.
+
+    The image is written to a temporary file and renamed into place, so a reader never sees a partially
+    written file.
+    """
+    partial = filename.with_name(f'.{filename.name}.{os.getpid()}.part')
+    try:
+        label_backend(LabelKind(kind))(code, partial)
+        os.replace(partial, filename)
+    finally:
+        partial.unlink(missing_ok=True)
+
+
+class LabelRenderer:
+    """Renders label images in a pool of worker processes, so PIL rasterization and PNG encoding happen
+    outside the request's write transaction and without holding the GIL.
+
+    max_workers=0 renders inline in the calling thread instead, which is mostly useful for tests.
+    """
+
+    def __init__(self, directory: Path, max_workers: Optional[int] = None):
+        self.directory = Path(directory)
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str, Future] = {}
+        self._lock = Lock()
+
+    def schedule(self, kind: LabelKind, code) -> Optional[Future]:
+        """Queue a label for rendering. Returns None if it has already been rendered."""
+        name = label_filename(kind, code)
+        path = self.directory / name
+        with self._lock:
+            future = self._pending.get(name)
+            if future is not None:
+                return future
+            if path.exists():
+                return None
+            if self.max_workers == 0:
+                future = Future()
+                try:
+                    render_label(kind.value, str(code), path)
+                    future.set_result(None)
+                except Exception as e:
+                    future.set_exception(e)
+                return future
+            if self._executor is None:
+                # Not forked from this process: a fork would copy locks that its other threads hold at the time.
+                # Workers start from a clean interpreter (the forkserver's, where there is one) instead.
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context(method))
+            future = self._executor.submit(render_label, kind.value, str(code), path)
+            self._pending[name] = future
+        future.add_done_callback(lambda _: self._forget(name))
+        return future
+
+    def wait(self, name: str, timeout: float) -> bool:
+        """Wait up to timeout seconds for a pending label to be rendered. Returns whether the image exists."""
+        with self._lock:
+            future = self._pending.get(name)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except FutureTimeoutError:
+                return False
+            except Exception:
+                pass
+        return (self.directory / name).exists()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _forget(self, name: str):
+        with self._lock:
+            self._pending.pop(name, None)
+
+
+class LabelCache:
+    """Size-bounded LRU of encoded label images, in front of the images on disk."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(name)
+            if data is not None:
+                self._entries.move_to_end(name)
+            return data
+
+    def put(self, name: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[name] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """Total size in bytes of the cached images."""
+        return self._size
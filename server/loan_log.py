@@ -0,0 +1,114 @@
+import datetime
+from enum import Enum
+import logging
+from os import PathLike
+import queue
+from threading import Event, Lock, Thread
+from typing import Iterable, Optional
+
+from server.db.db import DB
+
+logger = logging.getLogger(__name__)
+
+
+class LoanEventKind(Enum):
+    BORROW = 'borrow'
+    RETURN = 'return'
+
+
+class LoanEvent:
+    """One row of the loan history, with the user's name joined in if they still exist."""
+    __slots__ = ('tool_id', 'user_id', 'user_name', 'kind', 'at')
+
+    def __init__(self, tool_id: int, user_id: Optional[int], user_name: Optional[str], kind: LoanEventKind,
+                 at: str):
+        self.tool_id = tool_id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.kind = kind
+        self.at = at
+
+    @property
+    def at_human(self):
+        return datetime.datetime.fromisoformat(self.at).astimezone().strftime("%Y-%m-%d %H:%M")
+
+
+class LoanLog:
+    """Appends loan events to the loan_events table from a background writer thread.
+
+    record() only queues the events, so signing a tool out costs no extra write on the request's connection.
+    The writer inserts everything that queued up while its previous commit was running in one transaction,
+    so a burst of scans is committed in a few batches instead of one commit per event. Events that are still
+    queued when the process dies are lost; call close() on shutdown to write them out.
+    """
+
+    _STOP = object()
+
+    def __init__(self, filename: str | bytes | PathLike[str], max_batch: int = 1000):
+        self.filename = filename
+        self.max_batch = max_batch
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+
+    def record(self, kind: LoanEventKind, tool_ids: Iterable[int], user_id: Optional[int]):
+        """Queue an event for each tool. Call after the change itself has been committed."""
+        at = datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
+        self._start()
+        for tool_id in tool_ids:
+            self._queue.put((tool_id, user_id, kind.value, at))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every event recorded so far has been committed. Returns False on timeout."""
+        if self._thread is None:
+            return True
+        done = Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Write out the queued events and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(self._STOP)
+            thread.join()
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='loan-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        with DB(self.filename) as db:
+            stopping = False
+            while not stopping:
+                # Block for the first item, then take whatever else is already waiting
+                items = [self._queue.get()]
+                while len(items) < self.max_batch:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                events = []
+                flushes = []
+                for item in items:
+                    if item is self._STOP:
+                        stopping = True
+                    elif isinstance(item, Event):
+                        flushes.append(item)
+                    else:
+                        events.append(item)
+                if events:
+                    try:
+                        db.cursor.executemany(
+                            'INSERT INTO loan_events (tool_id, user_id, event, at) VALUES (?, ?, ?, ?)', events)
+                        db.conn.commit()
+                    except Exception:
+                        db.conn.rollback()
+                        logger.exception(f'Failed to write {len(events)} loan events')
+                for done in flushes:
+                    done.set()
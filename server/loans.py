@@ -0,0 +1,73 @@
+import datetime
+from enum import Enum
+import json
+from typing import Dict, Iterable, Optional
+
+from server.db.db import DB
+
+
+class LoanFailure(Enum):
+    """Why a tool could not be signed out or returned."""
+    NOT_FOUND = 'does not exist'
+    UNAVAILABLE = 'is already signed out'
+    NOT_SIGNED_OUT = 'is not signed out'
+
+
+class Loans:
+    """Signs tools out and back in.
+
+    Each operation is a single conditional UPDATE that only matches tools in the expected state, so when two
+    kiosks scan the same tool at once exactly one of them succeeds. Carts of tools are handled by one
+    statement for the whole cart. Nothing is committed here; the caller commits once for the whole operation.
+    """
+
+    def __init__(self, db: DB):
+        self.db = db
+
+    def borrow(self, tool_id: int, user_id: int) -> Optional[LoanFailure]:
+        """Sign a tool out to a user. Returns None on success."""
+        return self.borrow_many([tool_id], user_id)[tool_id]
+
+    def give_back(self, tool_id: int) -> Optional[LoanFailure]:
+        """Return a signed out tool. Returns None on success."""
+        return self.give_back_many([tool_id])[tool_id]
+
+    def borrow_many(self, tool_ids: Iterable[int], user_id: int) -> Dict[int, Optional[LoanFailure]]:
+        """Sign all available tools of a cart out to a user, with the outcome for each tool in cart order."""
+        tool_ids = list(dict.fromkeys(tool_ids))
+        self.db.cursor.execute('''
+            UPDATE inventory
+            SET signed_out = 1,
+                holder_id = ?,
+                signed_out_since = ?
+            WHERE id IN (SELECT value FROM json_each(?)) AND signed_out = 0
+            RETURNING id
+        ''', (user_id, datetime.datetime.now().isoformat(), json.dumps(tool_ids)))
+        return self._outcomes(tool_ids, LoanFailure.UNAVAILABLE)
+
+    def give_back_many(self, tool_ids: Iterable[int]) -> Dict[int, Optional[LoanFailure]]:
+        """Return all signed out tools of a cart, with the outcome for each tool in cart order."""
+        tool_ids = list(dict.fromkeys(tool_ids))
+        self.db.cursor.execute('''
+            UPDATE inventory
+            SET signed_out = 0,
+                holder_id = NULL,
+                signed_out_since = NULL
+            WHERE id IN (SELECT value FROM json_each(?)) AND signed_out = 1
+            RETURNING id
+        ''', (json.dumps(tool_ids),))
+        return self._outcomes(tool_ids, LoanFailure.NOT_SIGNED_OUT)
+
+    def _outcomes(self, tool_ids: list, failure: LoanFailure) -> Dict[int, Optional[LoanFailure]]:
+        """Outcomes for the UPDATE just run, telling missing tools apart from ones in the wrong state."""
+        updated = {row[0] for row in self.db.cursor.fetchall()}
+        missed = [tool_id for tool_id in tool_ids if tool_id not in updated]
+        existing = set()
+        if missed:
+            self.db.cursor.execute('SELECT id FROM inventory WHERE id IN (SELECT value FROM json_each(?))',
+                                   (json.dumps(missed),))
+            existing = {row[0] for row in self.db.cursor.fetchall()}
+        return {
+            tool_id: None if tool_id in updated else failure if tool_id in existing else LoanFailure.NOT_FOUND
+            for tool_id in tool_ids
+        }
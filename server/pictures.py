@@ -0,0 +1,170 @@
+from enum import Enum
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+import threading
+from typing import IO, TYPE_CHECKING, Optional, Tuple
+
+from server.db.db import DB
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+class PictureVariant(Enum):
+    """Downscaled copies of a tool picture that pages show instead of the uploaded original."""
+    THUMB = 'thumb'
+    DISPLAY = 'display'
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Bounding box the variant is scaled down to fit in."""
+        return (160, 160) if self is PictureVariant.THUMB else (960, 960)
+
+
+VARIANTS_DIRNAME = 'variants'
+WEBP_QUALITY = 80
+
+
+def variant_path(directory: Path, picture: str, variant: PictureVariant) -> Path:
+    """Where a variant of a picture in directory is stored. Variants are WEBP, whatever the original was."""
+    return Path(directory) / VARIANTS_DIRNAME / f'{picture}.{variant.value}.webp'
+
+
+def is_picture_name(name: str) -> bool:
+    """Whether name could be a picture stored directly in the picture directory: a single path component that
+    isn't hidden, as staged uploads are, and on Windows not drive-relative (C:name). Only looks at the string,
+    so checking a requested name costs no filesystem calls."""
+    return bool(name) and not name.startswith('.') and not any(c in name for c in '/\\:\0')
+
+
+def make_variants(directory: Path, picture: str):
+    """Decode a picture once and write all of its variants, upright according to its EXIF orientation.
+
+    Raises OSError (including PIL.UnidentifiedImageError) if the picture can't be read.
+    """
+    # Pillow is imported on first use, so processes that never handle a picture don't pay for it
+    from PIL import Image, ImageOps
+
+    variants = sorted(PictureVariant, key=lambda variant: variant.size, reverse=True)
+    with Image.open(Path(directory) / picture) as image:
+        # Let the JPEG decoder downscale while decoding; everything we write is much smaller than a phone photo
+        largest = variants[0].size
+        image.draft('RGB', (largest[0] * 2, largest[1] * 2))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        # Each variant is scaled from the previous, larger one rather than from the original
+        for variant in variants:
+            image.thumbnail(variant.size, Image.Resampling.LANCZOS)
+            _save_webp(image, variant_path(directory, picture, variant))
+
+
+def remove_variants(directory: Path, picture: str):
+    for variant in PictureVariant:
+        variant_path(directory, picture, variant).unlink(missing_ok=True)
+
+
+def _save_webp(image: 'Image.Image', path: Path):
+    """Write the image to a temporary file and rename it into place, so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.part')
+    try:
+        image.save(partial, 'WEBP', quality=WEBP_QUALITY, method=4)
+        os.replace(partial, path)
+    finally:
+        partial.unlink(missing_ok=True)
+
+
+# Extensions kept on stored pictures, so they are served with the right content type
+_EXTENSIONS = {'.jpg': '.jpg', '.jpeg': '.jpg', '.png': '.png', '.gif': '.gif', '.webp': '.webp', '.bmp': '.bmp'}
+
+
+class StagedPicture:
+    """An upload that has been written to a temporary file and hashed, but not yet published."""
+
+    def __init__(self, path: Path, name: str):
+        self.path = path
+        self.name = name
+
+
+class ReleasedPicture:
+    """A picture that no tool refers to any more, moved aside until the transaction that released it ends."""
+
+    def __init__(self, path: Path, name: str):
+        self.path = path
+        self.name = name
+
+
+class PictureStore:
+    """Tool pictures stored under the SHA-256 of their content, so identical uploads are stored once.
+
+    A stored picture is shared by every tool whose picture column names it, and is only deleted once none
+    does. publish() and release() must both be called while holding the write lock (BEGIN IMMEDIATE), so a
+    picture can't be released between being published for a new tool and that tool's row being written.
+    Pictures stored under their uploaded file name before this existed are released the same way.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def stage(self, upload: IO[bytes], filename: str) -> StagedPicture:
+        """Copy an upload to a temporary file in chunks, hashing it on the way. Doesn't need the write lock."""
+        digest = hashlib.sha256()
+        fd, temp = tempfile.mkstemp(dir=self.directory, prefix='.upload-', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while chunk := upload.read(self.CHUNK_SIZE):
+                    digest.update(chunk)
+                    out.write(chunk)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        extension = _EXTENSIONS.get(Path(filename).suffix.lower(), '')
+        return StagedPicture(Path(temp), f'{digest.hexdigest()}{extension}')
+
+    def publish(self, staged: StagedPicture) -> str:
+        """Move a staged picture into place, unless the same content is already stored, and return its name."""
+        final = self.directory / staged.name
+        if final.exists():
+            staged.path.unlink(missing_ok=True)
+        else:
+            os.replace(staged.path, final)
+        return staged.name
+
+    def discard(self, staged: StagedPicture):
+        """Drop a staged picture that wasn't published. Does nothing once it has been."""
+        staged.path.unlink(missing_ok=True)
+
+    def release(self, db: DB, name: str) -> Optional[ReleasedPicture]:
+        """Move a picture aside if no tool refers to it any more, to be deleted once that change is committed.
+
+        Call inside the write transaction that removed the reference, then delete() the result after committing
+        it, or restore() it after rolling back. The picture is moved to a hidden name that publish() doesn't
+        look at, so the same content uploaded after the commit is stored again rather than deleted with it.
+        """
+        db.cursor.execute('SELECT COUNT(*) FROM inventory WHERE picture = ?', (name,))
+        if db.cursor.fetchone()[0]:
+            return None
+        aside = self.directory / f'.released-{name}'
+        try:
+            os.replace(self.directory / name, aside)
+        except FileNotFoundError:
+            # Already gone, but it may still have variants
+            pass
+        return ReleasedPicture(aside, name)
+
+    def delete(self, released: ReleasedPicture):
+        """Delete a released picture and its variants, once the transaction that released it has committed."""
+        released.path.unlink(missing_ok=True)
+        remove_variants(self.directory, released.name)
+
+    def restore(self, released: ReleasedPicture):
+        """Put a released picture back, after the transaction that released it was rolled back."""
+        try:
+            os.replace(released.path, self.directory / released.name)
+        except FileNotFoundError:
+            pass
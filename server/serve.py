@@ -0,0 +1,70 @@
+import logging
+import os
+from typing import Callable
+
+from flask import Flask
+
+logger = logging.getLogger(__name__)
+
+# Each open dashboard holds a request thread for its event stream, on top of ordinary requests. Idle threads only
+# cost their stack, so there are enough for a tool room's worth of dashboards on a single core.
+DEFAULT_THREADS = 32
+# Open event streams only end when a worker gives up waiting for them; browsers reconnect and resume by themselves
+GRACEFUL_TIMEOUT_SECONDS = 10
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def max_event_streams(threads: int) -> int:
+    """How many of a worker's request threads may be held by open event streams, leaving the rest for requests."""
+    return max(1, threads // 2)
+
+
+def serve(app: Flask, host: str, port: int, workers: int, threads: int, on_worker_exit: Callable[[], None]):
+    """Serve the app from pre-forked gunicorn worker processes, each handling requests on a pool of threads.
+
+    The app is imported once in the master process and inherited by the workers, so one-off startup work such
+    as migrating the database must be done before calling this, and must not leave connections or threads
+    behind for the workers to inherit. Module level state that has to agree between workers (e.g. the ETag
+    salt) is shared for the same reason.
+
+    SIGHUP replaces the workers gracefully, e.g. to pick up changed templates. To run new code, send SIGUSR2
+    to start a new master alongside the old one, then SIGQUIT to the old one.
+
+    Event streams hold a thread each for as long as they are open, so a worker only keeps max_event_streams of
+    them open at a time (see main.dashboard_events); dashboards beyond that poll.
+
+    gunicorn doesn't run on Windows. Without it the app is served by Werkzeug's threaded server from this
+    process, which can't use more than one core.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        logger.warning('gunicorn is not available, serving from a single process')
+        from werkzeug.serving import run_simple
+        try:
+            run_simple(host, port, app, threaded=True)
+        finally:
+            on_worker_exit()
+        return
+
+    options = {
+        'bind': f'[{host}]:{port}' if ':' in host else f'{host}:{port}',
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': threads,
+        'graceful_timeout': GRACEFUL_TIMEOUT_SECONDS,
+        'worker_exit': lambda server, worker: on_worker_exit(),
+    }
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Application().run()
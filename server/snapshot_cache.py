@@ -0,0 +1,41 @@
+from threading import Lock
+from typing import Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class SnapshotCache:
+    """Process-wide cache of query results, valid for a single data generation (see DB.data_generation).
+
+    Cached values are shared between requests, so they must be treated as read-only. When the data
+    generation moves on every entry is dropped and values are reloaded on their next use, so reads
+    between writes never hit the database beyond reading the generation itself.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._generation: Optional[int] = None
+        self._entries: Dict[Hashable, object] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, generation: int, load: Callable[[], T]) -> T:
+        """Return the cached value for key at this generation, loading it if necessary."""
+        with self._lock:
+            if generation != self._generation:
+                self._entries = {}
+                self._generation = generation
+            if key in self._entries:
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        value = load()
+        with self._lock:
+            if generation == self._generation:
+                if len(self._entries) >= self.max_entries:
+                    # Drop the oldest entry; dicts keep insertion order
+                    del self._entries[next(iter(self._entries))]
+                self._entries[key] = value
+        return value
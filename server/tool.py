@@ -1,20 +1,31 @@
 import datetime
 from pathlib import Path
-from typing import Optional, Self, Tuple
+from typing import Optional, Self, Tuple, Union
 
 
 class Tool:
+    # Listings hydrate a Tool per row, so keep them small: no per-instance __dict__, and the picture path and
+    # signed out timestamp are kept as stored in the database until they are read
+    __slots__ = ('tool_id', 'name', 'barcode', 'description', '_picture', 'signed_out', 'holder_id',
+                 '_signed_out_since', 'holder_name')
+
+    _COLUMNS = ('id', 'name', 'barcode', 'description', 'picture', 'signed_out', 'holder_id', 'signed_out_since')
+    _PROJECTION = (f"({','.join(_COLUMNS)})", f"({','.join('?' * len(_COLUMNS))})")
+
     def __init__(self, tool_id: Optional[int], name: str, barcode: Optional[str],
-                 description: str, picture: Optional[Path], signed_out: bool,
-                 holder_id: Optional[int], signed_out_since: Optional[datetime.datetime]):
+                 description: str, picture: Optional[Union[Path, str]], signed_out: bool,
+                 holder_id: Optional[int], signed_out_since: Optional[Union[datetime.datetime, str]],
+                 holder_name: Optional[str] = None):
         self.tool_id = tool_id
         self.name = name
         self.barcode = barcode
         self.description = description
-        self.picture = picture
+        self._picture = picture
         self.signed_out = signed_out
         self.holder_id = holder_id
-        self.signed_out_since = signed_out_since
+        self._signed_out_since = signed_out_since
+        # Only populated by queries that join in the holder from the users table
+        self.holder_name = holder_name
 
     def __repr__(self):
         return (f"Tool(tool_id={self.tool_id}, name={self.name}, barcode={self.barcode}, "
@@ -22,6 +33,28 @@ class Tool:
                 f"signed_out={self.signed_out}, holder_id={self.holder_id}, "
                 f"signed_out_since={self.signed_out_since})")
 
+    @property
+    def picture(self) -> Optional[Path]:
+        picture = self._picture
+        if picture is not None and not isinstance(picture, Path):
+            picture = self._picture = Path(picture)
+        return picture
+
+    @picture.setter
+    def picture(self, picture: Optional[Union[Path, str]]):
+        self._picture = picture
+
+    @property
+    def signed_out_since(self) -> Optional[datetime.datetime]:
+        since = self._signed_out_since
+        if since is not None and not isinstance(since, datetime.datetime):
+            since = self._signed_out_since = self.parse_db_signed_out_since(since)
+        return since
+
+    @signed_out_since.setter
+    def signed_out_since(self, since: Optional[Union[datetime.datetime, str]]):
+        self._signed_out_since = since
+
     @property
     def signed_out_since_human(self):
         return self.signed_out_since.astimezone().strftime("%Y-%m-%d %H:%M")
@@ -35,39 +68,26 @@ class Tool:
 
     @property
     def picture_url(self):
-        if self.picture is None:
-            return None
-        return self.picture
+        # The stored name is all a URL needs, so don't build a Path for it
+        return self._picture
 
     @classmethod
     def from_row(cls, row) -> Self:
         if row is None:
             raise ValueError('No row returned')
-        path = None
-        if row[4] is not None:
-            path = Path(row[4])
         holder_id = None
         if row[6] is not None:
             holder_id = int(row[6])
-        since = None
-        if row[7] is not None:
-            since = cls.parse_db_signed_out_since(row[7])
-        return cls(int(row[0]), row[1], row[2], row[3], path, bool(row[5]), holder_id, since)
+        return cls(int(row[0]), row[1], row[2], row[3], row[4], bool(row[5]), holder_id, row[7])
 
     def to_row_and_projection(self) -> Tuple[Tuple, Tuple[str, str]]:
-        col_names = ['id', 'name', 'barcode', 'description', 'picture', 'signed_out', 'holder_id', 'signed_out_since']
-        col_markers = ['?', '?', '?', '?', '?', '?', '?', '?']
-        projection = (
-            f"({','.join(col_names)})",
-            f"({','.join(col_markers)})",
-        )
-        row = (self.tool_id, self.name, self.barcode, self.description, self.picture, self.signed_out, self.holder_id, self.signed_out_since)
+        row = (self.tool_id, self.name, self.barcode, self.description, self._picture, self.signed_out,
+               self.holder_id, self._signed_out_since)
+        return row, self._PROJECTION
 
-        return row, projection
-
-    @staticmethod
-    def default_projection() -> list[str]:
-        return ["id", "name", "barcode", "description", "picture", "signed_out", "holder_id", "signed_out_since"]
+    @classmethod
+    def default_projection(cls) -> list[str]:
+        return list(cls._COLUMNS)
 
     @staticmethod
     def db_format_signed_out_since(since: datetime.datetime) -> str:
@@ -0,0 +1,165 @@
+import logging
+from os import PathLike
+from threading import Condition, Event, Lock, Thread
+from typing import List, Optional, Set
+
+from server.db.db import DB
+from server.db.repository import ToolRepository
+from server.tool import Tool
+
+logger = logging.getLogger(__name__)
+
+
+def last_change_id(db: DB) -> int:
+    """Id of the most recent row in tool_changes, to subscribe to changes made after a page was read."""
+    return db.conn.execute('SELECT IFNULL(MAX(id), 0) FROM tool_changes').fetchone()[0]
+
+
+class ToolChange:
+    """The current state of a tool whose dashboard row changed, as of change_id. tool is None if it was deleted."""
+    __slots__ = ('change_id', 'tool_id', 'tool')
+
+    def __init__(self, change_id: int, tool_id: int, tool: Optional[Tool]):
+        self.change_id = change_id
+        self.tool_id = tool_id
+        self.tool = tool
+
+
+class Subscription:
+    """Changes waiting to be sent to one open dashboard."""
+
+    def __init__(self, since: Optional[int], max_backlog: int):
+        # Id of the last change delivered; None until the feed has seen where tool_changes currently ends
+        self.position = since
+        self.max_backlog = max_backlog
+        self.lost = False
+        self._changes: List[ToolChange] = []
+        self._ready = Condition()
+
+    def wait(self, timeout: float) -> Optional[List[ToolChange]]:
+        """Wait up to timeout seconds for changes. Returns an empty list on timeout, or None if changes were lost,
+        because the dashboard fell too far behind, and it has to be reloaded."""
+        with self._ready:
+            if not self._changes and not self.lost:
+                self._ready.wait(timeout)
+            if self.lost:
+                return None
+            changes, self._changes = self._changes, []
+            return changes
+
+    def deliver(self, changes: List[ToolChange]):
+        with self._ready:
+            if len(self._changes) + len(changes) > self.max_backlog:
+                self.lose()
+            else:
+                self._changes.extend(changes)
+                self._ready.notify()
+
+    def lose(self):
+        with self._ready:
+            self.lost = True
+            self._changes = []
+            self._ready.notify()
+
+
+class ToolFeed:
+    """Follows tool_changes on behalf of every open dashboard in this process.
+
+    Triggers record every committed change to a dashboard row in tool_changes (see DB._MIGRATIONS), whichever
+    process or route made it. One watcher thread per process reads new changes and the changed tools once and
+    hands the same objects to every subscription, so an idle dashboard costs a blocked thread and nothing else.
+    The watcher only runs while there are subscriptions. It checks every poll_interval seconds, or as soon as
+    poke() is called after a write in this process.
+    """
+
+    def __init__(self, filename: str | bytes | PathLike[str], poll_interval: float = 0.25,
+                 max_backlog: int = 1000):
+        self.filename = filename
+        self.poll_interval = poll_interval
+        self.max_backlog = max_backlog
+        self._subscriptions: Set[Subscription] = set()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+        self._wake = Event()
+
+    def subscribe(self, since: Optional[int] = None) -> Subscription:
+        """Subscribe to changes after the change with id since, or to changes from now on if it is None.
+
+        Changes made since then are caught up on from tool_changes, as long as they haven't been pruned.
+        """
+        subscription = Subscription(since, self.max_backlog)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='tool-feed', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def poke(self):
+        """Check for changes now rather than at the next poll. Call after committing a write."""
+        if self._thread is not None:
+            self._wake.set()
+
+    def _run(self):
+        try:
+            with DB(self.filename) as db:
+                while True:
+                    with self._lock:
+                        subscriptions = list(self._subscriptions)
+                        if not subscriptions:
+                            self._thread = None
+                            return
+                    try:
+                        self._poll(db, subscriptions)
+                    except Exception:
+                        db.conn.rollback()
+                        logger.exception('Failed to read tool changes')
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+        except Exception:
+            logger.exception('Tool feed stopped')
+            with self._lock:
+                subscriptions, self._subscriptions, self._thread = self._subscriptions, set(), None
+            for subscription in subscriptions:
+                subscription.lose()
+
+    @staticmethod
+    def _poll(db: DB, subscriptions: List[Subscription]):
+        # One read transaction, so the tools are read as of the last change seen
+        db.conn.execute('BEGIN')
+        try:
+            oldest, newest = db.conn.execute(
+                'SELECT IFNULL(MIN(id), 0), IFNULL(MAX(id), 0) FROM tool_changes').fetchone()
+            for subscription in subscriptions:
+                if subscription.position is None:
+                    subscription.position = newest
+                elif subscription.position > newest:
+                    # Not a change this database has made, e.g. from before the data was reset
+                    subscription.lose()
+                    subscription.position = newest
+            start = min(subscription.position for subscription in subscriptions)
+            if start >= newest:
+                return
+            # Several changes to one tool collapse into its latest state
+            latest = dict(db.conn.execute('SELECT tool_id, MAX(id) FROM tool_changes WHERE id > ? GROUP BY tool_id',
+                                          (start,)))
+            tools = ToolRepository(db).get_many(latest)
+        finally:
+            db.conn.commit()
+
+        changes = sorted(
+            (ToolChange(change_id, tool_id, tools.get(tool_id)) for tool_id, change_id in latest.items()),
+            key=lambda change: change.change_id)
+        for subscription in subscriptions:
+            if subscription.position >= newest:
+                continue
+            if subscription.position < oldest - 1:
+                subscription.lose()
+            else:
+                subscription.deliver([change for change in changes if change.change_id > subscription.position])
+            subscription.position = newest
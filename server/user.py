@@ -2,6 +2,11 @@ from typing import Optional, Self, Tuple
 
 
 class User:
+    __slots__ = ('user_id', 'name', 'barcode', 'is_admin', 'is_user')
+
+    _COLUMNS = ('id', 'name', 'barcode', 'is_admin', 'is_user')
+    _PROJECTION = (f"({','.join(_COLUMNS)})", f"({','.join('?' * len(_COLUMNS))})")
+
     def __init__(self, user_id: Optional[int], name: str, barcode: Optional[str],
                  is_admin: bool, is_user: bool):
         self.user_id = user_id
@@ -36,17 +41,10 @@ class User:
             raise ValueError('No row returned')
         return cls(int(row[0]), row[1], row[2], bool(row[3]), bool(row[4]))
 
-    @staticmethod
-    def default_projection() -> list[str]:
-        return ["id", "name", "barcode", "is_admin", "is_user"]
+    @classmethod
+    def default_projection(cls) -> list[str]:
+        return list(cls._COLUMNS)
 
     def to_row_and_projection(self) -> Tuple[Tuple, Tuple[str, str]]:
-        col_names = ['id', 'name', 'barcode', 'is_admin', 'is_user']
-        col_markers = ['?', '?', '?', '?', '?']
-        projection = (
-            f"({','.join(col_names)})",
-            f"({','.join(col_markers)})",
-        )
         row = (self.user_id, self.name, self.barcode, self.is_admin, self.is_user)
-
-        return row, projection
+        return row, self._PROJECTION
@@ -0,0 +1,78 @@
+import unittest
+
+from server.db.barcode_allocator import BarcodeAllocator, BarcodeNamespace
+from server.db.db import DB
+
+
+class TestBarcodeAllocator(unittest.TestCase):
+    def setUp(self):
+        self.db = DB(":memory:", auto_migrate=True)
+        self.db.connect()
+        self.tools = BarcodeAllocator(self.db, BarcodeNamespace.TOOLS)
+        self.users = BarcodeAllocator(self.db, BarcodeNamespace.USERS)
+
+    def tearDown(self):
+        self.db.close()
+
+    def add_tool(self, barcode):
+        self.db.cursor.execute('INSERT INTO inventory (name, barcode) VALUES (?, ?)', ('tool', barcode))
+
+    def test_allocates_sequentially(self):
+        for expected in (1, 2, 3):
+            barcode = self.tools.allocate()
+            self.assertEqual(expected, barcode)
+            self.add_tool(barcode)
+
+    def test_namespaces_are_independent(self):
+        self.add_tool(self.tools.allocate())
+        self.add_tool(self.tools.allocate())
+        self.assertEqual(1, self.users.allocate())
+
+    def test_skips_barcodes_in_use(self):
+        self.add_tool('1')
+        self.add_tool('2')
+        self.add_tool('4')
+        self.assertEqual(3, self.tools.allocate())
+        self.add_tool('3')
+        self.assertEqual(5, self.tools.allocate())
+
+    def test_released_barcodes_are_reused_lowest_first(self):
+        for _ in range(5):
+            self.add_tool(self.tools.allocate())
+        for barcode in ('4', '2'):
+            self.db.cursor.execute('DELETE FROM inventory WHERE barcode = ?', (barcode,))
+            self.tools.release(barcode)
+        self.assertEqual(2, self.tools.allocate())
+        self.add_tool('2')
+        self.assertEqual(4, self.tools.allocate())
+        self.add_tool('4')
+        self.assertEqual(6, self.tools.allocate())
+
+    def test_claimed_barcodes_are_not_reused(self):
+        for _ in range(3):
+            self.add_tool(self.tools.allocate())
+        self.db.cursor.execute("DELETE FROM inventory WHERE barcode = '2'")
+        self.tools.release('2')
+        self.tools.claim('2')
+        self.assertEqual(4, self.tools.allocate())
+
+    def test_non_numeric_barcodes_are_ignored(self):
+        for barcode in ('abc', '007', None, '-1'):
+            self.tools.release(barcode)
+            self.tools.claim(barcode)
+        self.assertEqual(1, self.tools.allocate())
+
+    def test_release_above_sequence_is_ignored(self):
+        self.tools.release('100')
+        self.db.cursor.execute('SELECT COUNT(*) FROM barcode_free_list')
+        self.assertEqual(0, self.db.cursor.fetchone()[0])
+
+    def test_allocation_rolls_back_with_transaction(self):
+        self.db.cursor.execute('BEGIN IMMEDIATE TRANSACTION')
+        self.assertEqual(1, self.tools.allocate())
+        self.db.conn.rollback()
+        self.assertEqual(1, self.tools.allocate())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+
+from server.barcode_index import BarcodeIndex, normalize_barcode
+from server.db.barcode_allocator import BarcodeNamespace
+from server.db.db import DB
+
+
+class TestNormalizeBarcode(unittest.TestCase):
+    def test_canonical_form(self):
+        self.assertEqual('42', normalize_barcode(42))
+        self.assertEqual('42', normalize_barcode(' 42\n'))
+        self.assertEqual('007', normalize_barcode('007'))
+        self.assertIsNone(normalize_barcode(''))
+        self.assertIsNone(normalize_barcode('  '))
+        self.assertIsNone(normalize_barcode(None))
+
+
+class TestBarcodeIndex(unittest.TestCase):
+    def setUp(self):
+        self.db = DB(":memory:", auto_migrate=True)
+        self.db.connect()
+        self.db.cursor.execute("INSERT INTO users (id, name, barcode) VALUES (1, 'Alice', '5')")
+        self.db.cursor.executemany('INSERT INTO inventory (id, name, barcode) VALUES (?, ?, ?)',
+                                   [(1, 'Hammer', '5'), (2, 'Wrench', 6)])
+        self.index = BarcodeIndex()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_lookup(self):
+        self.assertEqual(1, self.index.lookup(self.db, BarcodeNamespace.TOOLS, '5'))
+        self.assertEqual(2, self.index.lookup(self.db, BarcodeNamespace.TOOLS, 6))
+        self.assertEqual(1, self.index.lookup(self.db, BarcodeNamespace.USERS, ' 5 '))
+        self.assertIsNone(self.index.lookup(self.db, BarcodeNamespace.USERS, '6'))
+        self.assertIsNone(self.index.lookup(self.db, BarcodeNamespace.USERS, ''))
+
+    def test_follows_barcode_changes(self):
+        self.index.lookup(self.db, BarcodeNamespace.TOOLS, '5')
+        self.db.cursor.execute("UPDATE inventory SET barcode = '7' WHERE id = 1")
+        self.assertIsNone(self.index.lookup(self.db, BarcodeNamespace.TOOLS, '5'))
+        self.assertEqual(1, self.index.lookup(self.db, BarcodeNamespace.TOOLS, '7'))
+        self.db.cursor.execute('DELETE FROM inventory WHERE id = 2')
+        self.assertIsNone(self.index.lookup(self.db, BarcodeNamespace.TOOLS, '6'))
+
+    def test_loans_do_not_rebuild(self):
+        self.index.lookup(self.db, BarcodeNamespace.TOOLS, '5')
+        generation = self.db.barcode_generation()
+        self.db.cursor.execute('UPDATE inventory SET signed_out = 1, holder_id = 1 WHERE id = 1')
+        self.assertEqual(generation, self.db.barcode_generation())
+        with mock.patch.object(self.db, 'conn', wraps=self.db.conn) as conn:
+            self.assertEqual(1, self.index.lookup(self.db, BarcodeNamespace.TOOLS, '5'))
+            conn.execute.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import io
+import json
+import unittest
+from unittest import mock
+
+from server import bulk_io
+from server.bulk_io import TABLES, BulkFormat, export_rows, import_rows
+from server.db.db import DB
+
+
+class TestBulkIO(unittest.TestCase):
+    def setUp(self):
+        self.db = DB(":memory:", auto_migrate=True)
+        self.db.connect()
+
+    def tearDown(self):
+        self.db.close()
+
+    def import_text(self, kind, text, fmt, allocate_barcodes=False):
+        return import_rows(self.db, TABLES[kind], io.BytesIO(text.encode()), fmt, allocate_barcodes)
+
+    def barcodes(self):
+        self.db.cursor.execute('SELECT name, barcode FROM inventory ORDER BY id')
+        return self.db.cursor.fetchall()
+
+    def test_csv_import(self):
+        report = self.import_text('tools', 'name,barcode,description\nHammer,7,Hits stuff\nSaw,,\n',
+                                  BulkFormat.CSV)
+        self.assertEqual(2, report.imported)
+        self.assertEqual([], report.errors)
+        self.assertEqual([('Hammer', '7'), ('Saw', None)], self.barcodes())
+
+    def test_allocates_around_barcodes_in_file(self):
+        self.import_text('tools', 'name,barcode\nA,\nB,1\nC,\n', BulkFormat.CSV, allocate_barcodes=True)
+        self.assertEqual([('A', '2'), ('B', '1'), ('C', '3')], self.barcodes())
+
+    def test_bad_rows_are_skipped(self):
+        with mock.patch.object(bulk_io, 'IMPORT_CHUNK_SIZE', 2):
+            report = self.import_text('tools', '\n'.join([
+                json.dumps({'name': 'Hammer', 'barcode': '1'}),
+                json.dumps({'name': 'Wrench', 'barcode': '1'}),
+                '{not json',
+                json.dumps({'barcode': '2'}),
+                json.dumps({'name': 'Saw', 'holder_id': 42}),
+                json.dumps({'name': 'Drill', 'signed_out': 'maybe'}),
+                json.dumps({'name': 'Level'}),
+            ]), BulkFormat.JSONL)
+        self.assertEqual(2, report.imported)
+        self.assertEqual([2, 3, 4, 5, 6], sorted(line for line, _ in report.errors))
+        self.assertEqual([('Hammer', '1'), ('Level', None)], self.barcodes())
+
+    def test_loan_columns_must_agree(self):
+        self.db.cursor.execute("INSERT INTO users (id, name) VALUES (1, 'Alice')")
+        self.db.conn.commit()
+        report = self.import_text('tools', '\n'.join([
+            'name,signed_out,holder_id,signed_out_since',
+            'Saw,yes,,',
+            'Drill,yes,1,yesterday',
+            'Level,no,1,',
+            'Hammer,no,,2024-01-01T10:00:00',
+            'Wrench,yes,1,2024-01-01 10:00:00+00:00',
+            'Clamp,yes,1,',
+        ]), BulkFormat.CSV)
+        self.assertEqual([2, 3, 4, 5], [line for line, _ in report.errors])
+        self.db.cursor.execute('SELECT name, signed_out_since FROM inventory ORDER BY id')
+        rows = self.db.cursor.fetchall()
+        self.assertEqual([('Wrench', '2024-01-01T10:00:00+00:00')], rows[:1])
+        self.assertEqual('Clamp', rows[1][0])
+        self.assertIsNotNone(rows[1][1])
+
+    def test_round_trip(self):
+        self.import_text('users', 'name,barcode,is_admin\nAlice,5,yes\nBob,,\n', BulkFormat.CSV)
+        for fmt in BulkFormat:
+            exported = ''.join(export_rows(self.db, TABLES['users'], fmt))
+            other = DB(":memory:", auto_migrate=True)
+            other.connect()
+            try:
+                report = import_rows(other, TABLES['users'], io.BytesIO(exported.encode()), fmt)
+                self.assertEqual(2, report.imported, report.summary())
+                other.cursor.execute('SELECT id, name, barcode, is_admin, is_user FROM users ORDER BY id')
+                self.assertEqual([(1, 'Alice', '5', 1, 1), (2, 'Bob', None, 0, 1)], other.cursor.fetchall())
+            finally:
+                other.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import sqlite3
+import unittest
+
+from server.db.db import DB
+from server.db.repository import ToolRepository, UserRepository, _keyset_clause, encode_cursor
+
+
+class TestDBIndexes(unittest.TestCase):
+    def setUp(self):
+        self.db = DB(":memory:", auto_migrate=True)
+        self.db.connect()
+
+    def tearDown(self):
+        self.db.close()
+
+    def query_plan(self, sql, params=()) -> str:
+        self.db.cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return '\n'.join(row[3] for row in self.db.cursor.fetchall())
+
+    def assertUsesIndex(self, index, sql, params=()):
+        plan = self.query_plan(sql, params)
+        self.assertIn(f'INDEX {index}', plan, f'Expected {index} to be used by: {sql}\nPlan:\n{plan}')
+
+    def test_barcode_checks_use_index(self):
+        self.assertUsesIndex('inventory_barcode', 'SELECT name FROM inventory WHERE barcode = ?', ('1',))
+        self.assertUsesIndex('inventory_barcode', 'SELECT name FROM inventory WHERE barcode = ? and id != ?', ('1', 1))
+        self.assertUsesIndex('users_barcode', 'SELECT name FROM users WHERE barcode = ?', ('1',))
+        self.assertUsesIndex('users_barcode', 'SELECT name FROM users WHERE barcode = ? and id != ?', ('1', 1))
+
+    def test_signed_out_filters_use_index(self):
+        self.assertUsesIndex('inventory_signed_out_holder', 'SELECT id FROM inventory WHERE signed_out = 1')
+        self.assertUsesIndex('inventory_signed_out_holder',
+                             'SELECT id FROM inventory WHERE signed_out = 1 AND holder_id = ?', (1,))
+        self.assertUsesIndex('inventory_signed_out_holder', '''
+            UPDATE inventory SET signed_out = 0, holder_id = NULL, signed_out_since = NULL
+            WHERE signed_out = 1 AND holder_id = ?
+        ''', (1,))
+
+    def test_signed_out_since_uses_index(self):
+        self.assertUsesIndex('inventory_signed_out_since',
+                             'SELECT id FROM inventory WHERE signed_out_since < ? ORDER BY signed_out_since',
+                             ('2024-01-01',))
+
+    def test_listing_pages_seek_on_sort_index(self):
+        indexes = {
+            'name': 'inventory_name',
+            'barcode': 'inventory_barcode_sort',
+            'signed_out_since': 'inventory_signed_out_since_sort',
+        }
+        for sort, sort_expr in ToolRepository.SORT_COLUMNS.items():
+            for descending in (False, True):
+                clause, params = _keyset_clause(sort_expr, 'inventory.id', encode_cursor('x', 10), descending, 50)
+                sql = f'SELECT inventory.id FROM inventory {clause}'
+                self.assertUsesIndex(indexes[sort], sql, params)
+                self.assertNotIn('TEMP B-TREE', self.query_plan(sql, params))
+        indexes = {'name': 'users_name', 'barcode': 'users_barcode_sort'}
+        for sort, sort_expr in UserRepository.SORT_COLUMNS.items():
+            clause, params = _keyset_clause(sort_expr, 'id', encode_cursor('x', 10), False, 50)
+            self.assertUsesIndex(indexes[sort], f'SELECT id FROM users {clause}', params)
+
+    def test_barcodes_are_unique(self):
+        self.db.cursor.execute("INSERT INTO inventory (name, barcode) VALUES ('Hammer', '1')")
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.cursor.execute("INSERT INTO inventory (name, barcode) VALUES ('Wrench', '1')")
+        self.db.cursor.execute("INSERT INTO users (name, barcode) VALUES ('Alice', '1')")
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.cursor.execute("INSERT INTO users (name, barcode) VALUES ('Bob', '1')")
+
+    def test_missing_barcodes_are_not_unique(self):
+        self.db.cursor.execute("INSERT INTO inventory (name, barcode) VALUES ('Hammer', NULL)")
+        self.db.cursor.execute("INSERT INTO inventory (name, barcode) VALUES ('Wrench', NULL)")
+        self.db.cursor.execute('SELECT COUNT(*) FROM inventory')
+        self.assertEqual(2, self.db.cursor.fetchone()[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
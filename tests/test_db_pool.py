@@ -0,0 +1,90 @@
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from server.db.db import DB, DBPool
+
+
+class TestDBPool(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "test.db")
+        with DB(self.db_path, auto_migrate=True):
+            pass
+        self.pool = DBPool(self.db_path, max_size=2, checkout_timeout=0.2)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.temp_dir.cleanup()
+
+    def test_connection_is_reused(self):
+        db = self.pool.acquire()
+        self.pool.release(db)
+        self.assertIs(db, self.pool.acquire())
+        stats = self.pool.stats()
+        self.assertEqual(1, stats['size'])
+        self.assertEqual(2, stats['checkouts'])
+
+    def test_release_commits(self):
+        with self.pool.connection() as db:
+            db.cursor.execute("INSERT INTO users (name) VALUES ('Alice')")
+        with DB(self.db_path) as other:
+            other.cursor.execute('SELECT COUNT(*) FROM users')
+            self.assertEqual(1, other.cursor.fetchone()[0])
+
+    def test_release_with_rollback(self):
+        with self.assertRaises(KeyError):
+            with self.pool.connection() as db:
+                db.cursor.execute("INSERT INTO users (name) VALUES ('Alice')")
+                raise KeyError()
+        with self.pool.connection() as db:
+            db.cursor.execute('SELECT COUNT(*) FROM users')
+            self.assertEqual(0, db.cursor.fetchone()[0])
+
+    def test_checkout_times_out_when_exhausted(self):
+        first, second = self.pool.acquire(), self.pool.acquire()
+        with self.assertRaises(TimeoutError):
+            self.pool.acquire()
+        self.pool.release(first)
+        self.pool.release(second)
+        self.assertEqual(2, self.pool.stats()['idle'])
+
+    def test_waiting_checkout_is_recorded(self):
+        first, second = self.pool.acquire(), self.pool.acquire()
+        timer = threading.Timer(0.05, self.pool.release, (first,))
+        timer.start()
+        self.assertIs(first, self.pool.acquire())
+        timer.join()
+        stats = self.pool.stats()
+        self.assertEqual(1, stats['waited_checkouts'])
+        self.assertGreater(stats['max_wait_seconds'], 0)
+        self.pool.release(first)
+        self.pool.release(second)
+
+    def test_broken_connection_is_replaced(self):
+        db = self.pool.acquire()
+        self.pool.release(db)
+        db.conn.close()
+        replacement = self.pool.acquire()
+        self.assertIsNot(db, replacement)
+        replacement.self_test()
+        self.assertEqual(1, self.pool.stats()['replaced_connections'])
+        self.assertEqual(1, self.pool.stats()['size'])
+
+    def test_connections_move_between_threads(self):
+        def insert(i):
+            with self.pool.connection() as db:
+                db.cursor.execute('INSERT INTO users (name) VALUES (?)', (f'user{i}',))
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(insert, range(50)))
+        with self.pool.connection() as db:
+            db.cursor.execute('SELECT COUNT(*) FROM users')
+            self.assertEqual(50, db.cursor.fetchone()[0])
+        self.assertLessEqual(self.pool.stats()['size'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
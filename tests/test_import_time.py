@@ -0,0 +1,34 @@
+import os
+import re
+import subprocess
+import sys
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only imported once a label or picture is rendered (see server.labels.label_backend)
+LAZY_PACKAGES = ('PIL', 'qrcode', 'barcode')
+# Generous, so that slow CI machines pass, but far below what importing the rendering backends used to add
+IMPORT_BUDGET_SECONDS = 2.0
+
+
+def import_times(module: str) -> dict:
+    """Cumulative import time in seconds of every module imported by a fresh interpreter importing module."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for match in re.finditer(r'^import time:\s*\d+ \|\s*(\d+) \| ( *)(\S+)$', result.stderr, re.MULTILINE):
+        times[match.group(3)] = int(match.group(1)) / 1_000_000
+    return times
+
+
+class TestImportTime(unittest.TestCase):
+    def test_main_does_not_import_rendering_backends(self):
+        times = import_times('main')
+        imported = sorted(name for name in times if name.split('.')[0] in LAZY_PACKAGES)
+        self.assertEqual([], imported)
+        self.assertLess(times['main'], IMPORT_BUDGET_SECONDS)
+
+
+if __name__ == "__main__":
+    unittest.main()
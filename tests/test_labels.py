@@ -0,0 +1,83 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from server.labels import LabelCache, LabelKind, LabelRenderer, label_filename, parse_label_filename
+
+
+class TestLabelFilenames(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual('bar_12.png', label_filename(LabelKind.BARCODE, 12))
+        self.assertEqual((LabelKind.BARCODE, '12'), parse_label_filename('bar_12.png'))
+        self.assertEqual((LabelKind.QR, 'AB-3'), parse_label_filename('qr_AB-3.png'))
+
+    def test_rejects_other_names(self):
+        for name in ('jake.png', 'bar_.png', 'bar_1.jpg', 'bar_../1.png', 'qr_1 2.png'):
+            self.assertIsNone(parse_label_filename(name), name)
+
+
+class TestLabelRenderer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_inline_rendering(self):
+        renderer = LabelRenderer(self.directory, max_workers=0)
+        future = renderer.schedule(LabelKind.QR, '42')
+        self.assertIsNone(future.result())
+        self.assertTrue((self.directory / 'qr_42.png').exists())
+        self.assertIsNone(renderer.schedule(LabelKind.QR, '42'), 'Already rendered labels are not re-queued')
+
+    def test_background_rendering(self):
+        renderer = LabelRenderer(self.directory, max_workers=1)
+        try:
+            renderer.schedule(LabelKind.BARCODE, '7')
+            self.assertTrue(renderer.wait('bar_7.png', timeout=30))
+            self.assertGreater((self.directory / 'bar_7.png').stat().st_size, 0)
+            self.assertEqual(['bar_7.png'], [p.name for p in self.directory.iterdir()])
+        finally:
+            renderer.shutdown()
+
+    def test_wait_for_unknown_label(self):
+        renderer = LabelRenderer(self.directory, max_workers=0)
+        self.assertFalse(renderer.wait('bar_1.png', timeout=0))
+
+
+class TestLabelCache(unittest.TestCase):
+    def test_get_and_put(self):
+        cache = LabelCache(max_bytes=10)
+        self.assertIsNone(cache.get('bar_1.png'))
+        cache.put('bar_1.png', b'1234')
+        self.assertEqual(b'1234', cache.get('bar_1.png'))
+        self.assertEqual(4, cache.size)
+
+    def test_evicts_least_recently_used(self):
+        cache = LabelCache(max_bytes=10)
+        cache.put('a', b'1234')
+        cache.put('b', b'1234')
+        cache.get('a')
+        cache.put('c', b'1234')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(b'1234', cache.get('a'))
+        self.assertEqual(b'1234', cache.get('c'))
+        self.assertEqual(8, cache.size)
+
+    def test_replacing_entry_updates_size(self):
+        cache = LabelCache(max_bytes=10)
+        cache.put('a', b'1234')
+        cache.put('a', b'12')
+        self.assertEqual(2, cache.size)
+        self.assertEqual(1, len(cache))
+
+    def test_oversized_entries_are_not_cached(self):
+        cache = LabelCache(max_bytes=10)
+        cache.put('a', b'x' * 11)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, cache.size)
+
+
+if __name__ == "__main__":
+    unittest.main()
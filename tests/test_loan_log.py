@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from server.db.db import DB
+from server.db.repository import ToolRepository
+from server.loan_log import LoanEventKind, LoanLog
+
+
+class TestLoanLog(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'inventory.db')
+        self.db = DB(self.db_path, auto_migrate=True)
+        self.db.cursor.execute("INSERT INTO users (id, name) VALUES (1, 'Alice')")
+        self.db.conn.commit()
+        self.log = LoanLog(self.db_path)
+
+    def tearDown(self):
+        self.log.close()
+        self.db.close()
+        self.temp_dir.cleanup()
+
+    def test_events_are_written_in_order(self):
+        self.log.record(LoanEventKind.BORROW, [1, 2], 1)
+        self.log.record(LoanEventKind.RETURN, [1], None)
+        self.assertTrue(self.log.flush(timeout=5))
+        history = ToolRepository(self.db).history(1)
+        self.assertEqual([LoanEventKind.RETURN, LoanEventKind.BORROW], [event.kind for event in history])
+        self.assertEqual([None, 'Alice'], [event.user_name for event in history])
+
+    def test_burst_is_written(self):
+        generation = self.db.data_generation()
+        for tool_id in range(500):
+            self.log.record(LoanEventKind.BORROW, [tool_id], 1)
+        self.log.close()
+        self.db.cursor.execute('SELECT COUNT(*) FROM loan_events')
+        self.assertEqual(500, self.db.cursor.fetchone()[0])
+        self.assertEqual(generation + 500, self.db.data_generation())
+
+    def test_flush_without_events(self):
+        self.assertTrue(self.log.flush(timeout=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from server.db.db import DB
+from server.loans import LoanFailure, Loans
+
+
+class TestLoans(unittest.TestCase):
+    def setUp(self):
+        self.db = DB(":memory:", auto_migrate=True)
+        self.db.connect()
+        self.db.cursor.execute('INSERT INTO users (id, name) VALUES (1, ?)', ('Alice',))
+        self.db.cursor.executemany('INSERT INTO inventory (id, name) VALUES (?, ?)',
+                                   [(1, 'Hammer'), (2, 'Wrench'), (3, 'Saw')])
+        self.loans = Loans(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def holder(self, tool_id):
+        self.db.cursor.execute('SELECT signed_out, holder_id FROM inventory WHERE id = ?', (tool_id,))
+        return self.db.cursor.fetchone()
+
+    def test_borrow_and_give_back(self):
+        self.assertIsNone(self.loans.borrow(1, 1))
+        self.assertEqual((1, 1), self.holder(1))
+        self.assertEqual(LoanFailure.UNAVAILABLE, self.loans.borrow(1, 1))
+        self.assertIsNone(self.loans.give_back(1))
+        self.assertEqual((0, None), self.holder(1))
+        self.assertEqual(LoanFailure.NOT_SIGNED_OUT, self.loans.give_back(1))
+
+    def test_missing_tool(self):
+        self.assertEqual(LoanFailure.NOT_FOUND, self.loans.borrow(99, 1))
+        self.assertEqual(LoanFailure.NOT_FOUND, self.loans.give_back(99))
+
+    def test_cart_outcomes_in_order(self):
+        self.loans.borrow(2, 1)
+        outcomes = self.loans.borrow_many([3, 2, 99, 1, 3], 1)
+        self.assertEqual([3, 2, 99, 1], list(outcomes))
+        self.assertEqual({3: None, 2: LoanFailure.UNAVAILABLE, 99: LoanFailure.NOT_FOUND, 1: None}, outcomes)
+        self.assertEqual({1: None, 2: None, 3: None}, self.loans.give_back_many([1, 2, 3]))
+
+
+class TestConcurrentBorrow(unittest.TestCase):
+    def test_only_one_kiosk_wins(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'inventory.db')
+            with DB(path, auto_migrate=True) as db:
+                db.cursor.executemany('INSERT INTO users (id, name) VALUES (?, ?)', [(1, 'Alice'), (2, 'Bob')])
+                db.cursor.execute("INSERT INTO inventory (id, name) VALUES (1, 'Hammer')")
+            barrier = threading.Barrier(2)
+            outcomes = []
+
+            def kiosk(user_id):
+                with DB(path, check_same_thread=False) as db:
+                    barrier.wait()
+                    outcomes.append(Loans(db).borrow(1, user_id))
+
+            threads = [threading.Thread(target=kiosk, args=(user_id,)) for user_id in (1, 2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual([None, LoanFailure.UNAVAILABLE], sorted(outcomes, key=lambda o: o is not None))
+
+
+if __name__ == "__main__":
+    unittest.main()
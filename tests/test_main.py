@@ -1,6 +1,21 @@
+import io
+import json
+import os
+import re
+import tempfile
 import unittest
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+import main
 from main import sanitize_path, ensure_path_in_base
 from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+from server.db.db import DB, DBPool
+from server.loan_log import LoanLog
+from server.tool_feed import ToolFeed
 
 
 class TestSanitizePath(unittest.TestCase):
@@ -84,5 +99,399 @@ class TestEnsurePathInBase(unittest.TestCase):
             ensure_path_in_base(self.base_path, test_path, allow_subdirs=False)
 
 
+class AppTestCase(unittest.TestCase):
+    """Runs the app against a fresh database with a few users and tools."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'inventory.db')
+        with DB(self.db_path, auto_migrate=True) as db:
+            db.cursor.executemany('INSERT INTO users (id, name) VALUES (?, ?)', [(1, 'Alice'), (2, 'Bob')])
+            db.cursor.executemany('INSERT INTO inventory (id, name, barcode) VALUES (?, ?, ?)',
+                                  [(1, 'Hammer', '1'), (2, 'Wrench', '2')])
+        self.pool = DBPool(self.db_path)
+        self.loan_log = LoanLog(self.db_path)
+        self.tool_feed = ToolFeed(self.db_path, poll_interval=0.05)
+        for name, value in (('DB_POOL', self.pool), ('LOAN_LOG', self.loan_log), ('TOOL_FEED', self.tool_feed),
+                            ('BARCODES', main.BarcodeIndex())):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        self.loan_log.close()
+        self.pool.close_all()
+        self.temp_dir.cleanup()
+
+
+class TestConditionalGet(AppTestCase):
+    def test_unchanged_page_is_not_modified(self):
+        for url in ('/dashboard', '/manage-tools', '/manage-users', '/tool/1', '/user/1'):
+            response = self.client.get(url)
+            self.assertEqual(200, response.status_code)
+            etag = response.headers['ETag']
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(304, response.status_code, url)
+            self.assertEqual(b'', response.data)
+
+    def test_write_changes_etag(self):
+        etag = self.client.get('/dashboard').headers['ETag']
+        self.client.post('/borrow-tool', data={'tool_id': 1, 'user_id': 1})
+        response = self.client.get('/dashboard', headers={'If-None-Match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers['ETag'])
+
+    def test_etag_depends_on_query_string(self):
+        first = self.client.get('/manage-tools?per_page=1').headers['ETag']
+        second = self.client.get('/manage-tools?per_page=2').headers['ETag']
+        self.assertNotEqual(first, second)
+
+    def test_redirects_have_no_etag(self):
+        response = self.client.get('/tool/99')
+        self.assertEqual(302, response.status_code)
+        self.assertNotIn('ETag', response.headers)
+
+
+class TestStreamedListings(AppTestCase):
+    def test_listing_is_streamed(self):
+        response = self.client.get('/manage-tools')
+        self.assertTrue(response.is_streamed)
+        self.assertIn(b'Hammer', response.data)
+        self.assertIn(b'Wrench', response.data)
+
+    def test_pager_follows_streamed_rows(self):
+        response = self.client.get('/manage-users?per_page=1')
+        self.assertIn(b'Alice', response.data)
+        self.assertNotIn(b'Bob', response.data)
+        self.assertIn(b'Next page', response.data)
+
+    def test_connection_returned_after_stream(self):
+        self.client.get('/manage-tools').close()
+        self.assertEqual(0, self.pool.stats()['in_use'])
+
+
+class TestDashboardEvents(AppTestCase):
+    def read_events(self, url, count, **kwargs):
+        response = self.client.get(url, buffered=False, **kwargs)
+        self.assertEqual('text/event-stream', response.mimetype)
+        chunks = response.response
+        events = [next(chunks).decode() for _ in range(count)]
+        response.close()
+        return events
+
+    def test_changed_rows_are_sent(self):
+        page = self.client.get('/dashboard').get_data(as_text=True)
+        url = re.search(r'new EventSource\("([^"]+)"\)', page).group(1).replace('&amp;', '&')
+        self.client.post('/borrow-tool', data={'tool_id': 2, 'user_id': 1})
+
+        retry, event = self.read_events(url, 2)
+        self.assertEqual('retry: 2000\n\n', retry)
+        fields = dict(line.split(': ', 1) for line in event.strip().split('\n'))
+        self.assertEqual('tool', fields['event'])
+        change = json.loads(fields['data'])
+        self.assertEqual((2, 'signed_out'), (change['tool_id'], change['section']))
+        self.assertIn('id="tool-2"', change['row'])
+        self.assertIn('Alice', change['row'])
+
+    def test_resumes_after_last_event_id(self):
+        with DB(self.db_path) as db:
+            db.cursor.execute('DELETE FROM inventory WHERE id = 1')
+            db.cursor.execute('SELECT MAX(id) FROM tool_changes')
+            last_seen = db.cursor.fetchone()[0]
+            db.cursor.execute("UPDATE inventory SET name = 'Spanner' WHERE id = 2")
+        event = self.read_events('/dashboard/events?since=0', 2, headers={'Last-Event-ID': str(last_seen)})[1]
+        self.assertIn('"tool_id": 2', event)
+        self.assertIn('Spanner', event)
+
+    def test_polls_when_streams_are_taken(self):
+        with DB(self.db_path) as db:
+            db.cursor.execute('SELECT MAX(id) FROM tool_changes')
+            since = db.cursor.fetchone()[0]
+            db.cursor.execute("UPDATE inventory SET name = 'Spanner' WHERE id = 2")
+        with mock.patch.object(main, 'EVENT_STREAMS', main.BoundedSemaphore(0)):
+            events = list(self.client.get(f'/dashboard/events?since={since}').response)
+            self.assertEqual([], list(self.client.get(f'/dashboard/events?since={since + 1}').response)[1:])
+        self.assertEqual(f'retry: {main.EVENT_POLL_INTERVAL_MS}\n\n', events[0].decode())
+        self.assertEqual(2, len(events))
+        self.assertIn('Spanner', events[1].decode())
+
+
+class TestServeCommand(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.temp_dir.name) / 'inventory.db'
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_serve_migrates_once_and_keeps_data(self):
+        with DB(self.db_path, auto_migrate=True) as db:
+            db.cursor.execute("INSERT INTO users (name) VALUES ('Alice')")
+        pool = main.DBPool(self.db_path)
+        with mock.patch.object(main, 'DB_PATH', self.db_path), mock.patch.object(main, 'serve') as serve, \
+                mock.patch.object(main, 'LABELS', main.LabelRenderer(self.temp_dir.name)), \
+                mock.patch.object(main, 'DB_POOL', pool), mock.patch.object(main, 'EVENT_STREAMS'):
+            main.main(['serve', '--port', '8000', '--workers', '2', '--threads', '4'])
+        serve.assert_called_once_with(main.app, '::1', 8000, 2, 4, on_worker_exit=main.shutdown)
+        # Every request thread can have a connection
+        self.assertEqual(4, pool.max_size)
+        with DB(self.db_path) as db:
+            db.cursor.execute('SELECT name FROM users')
+            self.assertEqual([('Alice',)], db.cursor.fetchall())
+
+    def test_sample_data_only_when_asked(self):
+        with mock.patch.object(main, 'DB_PATH', self.db_path), mock.patch.object(main, 'app') as app:
+            main.main([])
+            app.run.assert_called_once()
+            with DB(self.db_path) as db:
+                db.cursor.execute('SELECT COUNT(*) FROM users')
+                self.assertEqual(0, db.cursor.fetchone()[0])
+            main.main(['dev', '--sample-data'])
+            with DB(self.db_path) as db:
+                db.cursor.execute('SELECT COUNT(*) FROM users')
+                self.assertEqual(3, db.cursor.fetchone()[0])
+
+    def test_warm_labels_renders_missing_labels(self):
+        labels = Path(self.temp_dir.name) / 'labels'
+        labels.mkdir()
+        with DB(self.db_path, auto_migrate=True) as db:
+            db.cursor.execute("INSERT INTO users (name, barcode) VALUES ('Alice', '7')")
+            db.cursor.executemany('INSERT INTO inventory (name, barcode) VALUES (?, ?)',
+                                  [('Hammer', '1'), ('Wrench', '2'), ('Saw', 'not a label'), ('Drill', None)])
+            (labels / 'bar_2.png').write_bytes(b'already rendered')
+            with mock.patch.object(main, 'LABELS', main.LabelRenderer(labels, max_workers=0)):
+                self.assertEqual(2, main.warm_labels(db, batch_size=2))
+        self.assertEqual(['bar_1.png', 'bar_2.png', 'qr_7.png'], sorted(path.name for path in labels.iterdir()))
+
+
+class TestCartCheckout(AppTestCase):
+    def test_borrow_and_return_cart(self):
+        response = self.client.post('/borrow-tools', data={'user_id': 1, 'tool_id': ['1', '2', '99']})
+        self.assertEqual(302, response.status_code)
+        result = json.loads(parse_qs(urlparse(response.location).query)['result'][0])
+        self.assertFalse(result['success'])
+        self.assertEqual([True, True, False], [item['success'] for item in result['items']])
+        self.assertIn('Alice', self.client.get('/tool/2').get_data(as_text=True))
+
+        response = self.client.post('/return-tools', data={'user_id': 1, 'tool_id': ['1', '2']})
+        result = json.loads(parse_qs(urlparse(response.location).query)['result'][0])
+        self.assertTrue(result['success'])
+        self.assertEqual('2 of 2 tools returned.', result['message'])
+
+
+class TestAddUser(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(main, 'LABELS', main.LabelRenderer(self.temp_dir.name, max_workers=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_user(self, **form):
+        response = self.client.post('/admin/add-user', data=dict(role='user', **form))
+        return json.loads(parse_qs(urlparse(response.location).query)['result'][0])
+
+    def test_add_user_with_barcode(self):
+        result = self.add_user(name='Carol', barcode='77')
+        self.assertTrue(result['success'], result['message'])
+        with DB(self.db_path) as db:
+            db.cursor.execute("SELECT barcode, is_admin FROM users WHERE name = 'Carol'")
+            self.assertEqual(('77', 0), db.cursor.fetchone())
+
+    def test_add_user_with_allocated_barcode(self):
+        result = self.add_user(name='Dave', allocate_barcode='on')
+        self.assertTrue(result['success'], result['message'])
+        with DB(self.db_path) as db:
+            db.cursor.execute("SELECT barcode FROM users WHERE name = 'Dave'")
+            self.assertIsNotNone(db.cursor.fetchone()[0])
+
+    def test_saved_even_if_label_cant_be_queued(self):
+        with mock.patch.object(main.LABELS, 'schedule', side_effect=BrokenProcessPool('worker died')):
+            result = self.add_user(name='Erin', barcode='78')
+        self.assertTrue(result['success'], result['message'])
+        with DB(self.db_path) as db:
+            db.cursor.execute("SELECT COUNT(*) FROM users WHERE name = 'Erin'")
+            self.assertEqual(1, db.cursor.fetchone()[0])
+
+
+class TestBulkImportExport(AppTestCase):
+    def test_import_then_export(self):
+        response = self.client.post('/admin/import/tools', data={
+            'file': (io.BytesIO(b'name,description\nSaw,Cuts stuff\n'), 'tools.csv'),
+            'allocate_barcode': 'on',
+        })
+        result = json.loads(parse_qs(urlparse(response.location).query)['result'][0])
+        self.assertTrue(result['success'], result['message'])
+        response = self.client.get('/admin/export/tools?format=jsonl')
+        self.assertTrue(response.is_streamed)
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(['Hammer', 'Wrench', 'Saw'], [row['name'] for row in rows])
+        self.assertEqual('3', rows[2]['barcode'])
+
+    def test_inconsistent_loans_are_rejected(self):
+        self.client.post('/admin/import/tools', data={
+            'file': (io.BytesIO(b'name,signed_out,holder_id,signed_out_since\nSaw,yes,,\nDrill,yes,1,yesterday\n'
+                                b'Level,no,1,\nClamp,yes,1,\n'), 'tools.csv'),
+        })
+        for url in ('/dashboard', '/manage-tools', '/tool/3'):
+            self.assertEqual(200, self.client.get(url).status_code, url)
+        with DB(self.db_path) as db:
+            db.cursor.execute('SELECT name FROM inventory WHERE id > 2')
+            self.assertEqual([('Clamp',)], db.cursor.fetchall())
+
+    def test_rejects_unknown_format(self):
+        response = self.client.post('/admin/import/users', data={'file': (io.BytesIO(b''), 'users.xlsx')})
+        result = json.loads(parse_qs(urlparse(response.location).query)['result'][0])
+        self.assertFalse(result['success'])
+        self.assertEqual(404, self.client.get('/admin/export/nope').status_code)
+
+
+class TestLoanHistory(AppTestCase):
+    def test_history_on_tool_detail(self):
+        self.client.post('/borrow-tool', data={'tool_id': 1, 'user_id': 2})
+        self.client.post('/return-tool', data={'tool_id': 1, 'user_id': 1})
+        self.assertTrue(self.loan_log.flush(timeout=5))
+        page = self.client.get('/tool/1').get_data(as_text=True)
+        self.assertLess(page.index('Returned by'), page.index('Signed out to'))
+
+
+class TestScanApi(AppTestCase):
+    def test_lookup(self):
+        body = self.client.get('/api/v1/lookup?barcode=2').get_json()
+        self.assertEqual('Wrench', body['tool']['name'])
+        self.assertIsNone(body['user'])
+        self.assertEqual(404, self.client.get('/api/v1/lookup?barcode=77').status_code)
+
+    def test_borrow_and_return_by_barcode(self):
+        response = self.client.post('/api/v1/borrow', json={'tool_barcode': '1', 'user_id': 2})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'tool_barcode': '1', 'tool_id': 1, 'success': True, 'error': None}, response.get_json())
+        response = self.client.post('/api/v1/borrow', json={'tool_id': 1, 'user_id': 1})
+        self.assertEqual(409, response.status_code)
+        self.assertEqual('unavailable', response.get_json()['error'])
+        self.assertEqual(200, self.client.post('/api/v1/return', json={'tool_id': 1}).status_code)
+        self.assertEqual(404, self.client.post('/api/v1/return', json={'tool_barcode': '9'}).status_code)
+
+    def test_batch(self):
+        response = self.client.post('/api/v1/batch', json={
+            'user_id': 1,
+            'borrow': [{'tool_id': 1}, {'tool_barcode': '2'}, {'tool_barcode': '9'}],
+        })
+        body = response.get_json()
+        self.assertFalse(body['success'])
+        self.assertEqual([True, True, False], [result['success'] for result in body['borrow']])
+        response = self.client.post('/api/v1/batch', json={'return': [{'tool_id': 1}, {'tool_id': 2}]})
+        self.assertTrue(response.get_json()['success'])
+
+    def test_bad_requests(self):
+        self.assertEqual(400, self.client.post('/api/v1/borrow', data='nope').status_code)
+        self.assertEqual(400, self.client.post('/api/v1/borrow', json={'tool_id': 1}).status_code)
+        self.assertEqual(404, self.client.post('/api/v1/borrow', json={'tool_id': 1, 'user_id': 9}).status_code)
+        self.assertEqual(400, self.client.post('/api/v1/batch', json={'borrow': [1], 'user_id': 1}).status_code)
+
+
+class TestSearchApi(AppTestCase):
+    def test_search(self):
+        body = self.client.get('/api/v1/tools/search?q=wre').get_json()
+        self.assertEqual(['Wrench'], [tool['name'] for tool in body['tools']])
+        self.assertEqual('/tool/2', body['tools'][0]['url'])
+        self.assertIsNone(body['next'])
+
+
+class TestPictureVariantRoute(AppTestCase):
+    def test_legacy_picture_gets_variant_on_request(self):
+        images = Path(self.temp_dir.name) / 'tool_images'
+        images.mkdir()
+        Image.new('RGB', (1200, 600)).save(images / 'saw.png')
+        with mock.patch.object(main, 'TOOL_IMAGES_PATH', images):
+            response = self.client.get('/tool-image/thumb/saw.png')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('image/webp', response.mimetype)
+            response.close()
+            self.assertTrue((images / 'variants' / 'saw.png.thumb.webp').exists())
+            self.assertEqual(404, self.client.get('/tool-image/display/missing.png').status_code)
+
+
+class TestImageCaching(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.images = Path(self.temp_dir.name) / 'tool_images'
+        self.images.mkdir()
+        Image.new('RGB', (32, 32)).save(self.images / 'saw.png')
+        patcher = mock.patch.object(main, 'TOOL_IMAGES_PATH', self.images)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_cached_forever(self, url):
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code, url)
+        self.assertTrue(response.cache_control.immutable)
+        self.assertEqual(main.IMMUTABLE_MAX_AGE, response.cache_control.max_age)
+        etag = response.headers['ETag']
+        response.close()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(304, response.status_code, url)
+        self.assertEqual(b'', response.data)
+
+    def test_pictures_and_variants_are_immutable(self):
+        self.assert_cached_forever('/tool-image/saw.png')
+        self.assert_cached_forever('/tool-image/thumb/saw.png')
+
+    def test_labels_are_immutable(self):
+        with mock.patch.object(main, 'TOOL_BARCODES_PATH', self.images), \
+                mock.patch.object(main, 'LABELS', main.LabelRenderer(self.images, max_workers=0)), \
+                mock.patch.object(main, 'LABEL_CACHE', main.LabelCache(max_bytes=1024 * 1024)):
+            self.assert_cached_forever('/tool-barcode/bar_1.png')
+            # Only barcodes that are in use get a label
+            self.assertEqual(404, self.client.get('/tool-barcode/bar_9.png').status_code)
+            self.assertEqual(404, self.client.get('/tool-barcode/qr_1.png').status_code)
+            self.assertFalse((self.images / 'qr_1.png').exists())
+
+    def test_names_outside_the_directory_are_not_served(self):
+        for name in ('.upload-x.part', '..%2Finventory.db', 'variants', 'variants/saw.png.thumb.webp'):
+            self.assertEqual(404, self.client.get(f'/tool-image/{name}').status_code, name)
+
+
+class TestToolPictureUploads(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.images = Path(self.temp_dir.name) / 'tool_images'
+        self.images.mkdir()
+        for name, value in (('TOOL_IMAGES_PATH', self.images), ('PICTURES', main.PictureStore(self.images))):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_tool(self, name):
+        picture = io.BytesIO()
+        Image.new('RGB', (64, 64), 'blue').save(picture, 'PNG')
+        picture.seek(0)
+        self.client.post('/admin/add-tool', data={'name': name, 'picture': (picture, 'image.png')})
+        with DB(self.db_path) as db:
+            db.cursor.execute('SELECT id, picture FROM inventory WHERE name = ?', (name,))
+            return db.cursor.fetchone()
+
+    def test_shared_picture_outlives_first_tool(self):
+        saw_id, saw_picture = self.add_tool('Saw')
+        drill_id, drill_picture = self.add_tool('Drill')
+        self.assertEqual(saw_picture, drill_picture)
+        self.assertTrue((self.images / 'variants' / f'{saw_picture}.thumb.webp').exists())
+
+        self.client.post('/admin/delete-tool', data={'tool_id': saw_id})
+        self.assertTrue((self.images / saw_picture).exists())
+        self.client.post('/admin/delete-tool', data={'tool_id': drill_id})
+        self.assertFalse((self.images / saw_picture).exists())
+        self.assertEqual([], [path.name for path in self.images.iterdir() if path.is_file()])
+
+    def test_failed_insert_leaves_no_picture(self):
+        picture = io.BytesIO()
+        Image.new('RGB', (64, 64), 'blue').save(picture, 'PNG')
+        picture.seek(0)
+        # A tool needs a name
+        response = self.client.post('/admin/add-tool', data={'picture': (picture, 'image.png')})
+        self.assertFalse(json.loads(parse_qs(urlparse(response.location).query)['result'][0])['success'])
+        self.assertEqual([], [path.name for path in self.images.iterdir() if path.is_file()])
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
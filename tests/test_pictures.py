@@ -0,0 +1,119 @@
+import hashlib
+import io
+from pathlib import Path
+import tempfile
+import unittest
+
+from PIL import Image
+
+from server.db.db import DB
+from server.pictures import (PictureStore, PictureVariant, is_picture_name, make_variants, remove_variants,
+                             variant_path)
+
+
+class TestPictureVariants(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_variants_are_upright_and_downscaled(self):
+        image = Image.new('RGB', (2000, 1500), 'red')
+        exif = image.getexif()
+        exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise to display
+        image.save(self.directory / 'photo.jpg', exif=exif)
+
+        make_variants(self.directory, 'photo.jpg')
+        with Image.open(variant_path(self.directory, 'photo.jpg', PictureVariant.DISPLAY)) as display:
+            self.assertEqual('WEBP', display.format)
+            self.assertEqual((720, 960), display.size)
+        with Image.open(variant_path(self.directory, 'photo.jpg', PictureVariant.THUMB)) as thumb:
+            self.assertEqual((120, 160), thumb.size)
+
+    def test_keeps_transparency(self):
+        Image.new('LA', (100, 50)).save(self.directory / 'logo.png')
+        make_variants(self.directory, 'logo.png')
+        with Image.open(variant_path(self.directory, 'logo.png', PictureVariant.THUMB)) as thumb:
+            self.assertEqual('RGBA', thumb.mode)
+            self.assertEqual((100, 50), thumb.size)
+
+    def test_remove_variants(self):
+        Image.new('RGB', (10, 10)).save(self.directory / 'small.png')
+        make_variants(self.directory, 'small.png')
+        remove_variants(self.directory, 'small.png')
+        self.assertEqual([], list((self.directory / 'variants').iterdir()))
+
+    def test_unreadable_picture(self):
+        (self.directory / 'notes.png').write_text('not an image')
+        with self.assertRaises(OSError):
+            make_variants(self.directory, 'notes.png')
+
+
+class TestIsPictureName(unittest.TestCase):
+    def test_picture_names(self):
+        self.assertTrue(is_picture_name('0f3a9c.png'))
+        self.assertTrue(is_picture_name('legacy upload.jpg'))
+
+    def test_names_outside_the_directory(self):
+        for name in ('', '.upload-1.part', '../inventory.db', 'a/b.png', 'a\\b.png', 'C:secret.db', 'a\0.png'):
+            self.assertFalse(is_picture_name(name), name)
+
+
+class TestPictureStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.temp_dir.name)
+        self.store = PictureStore(self.directory)
+        self.db = DB(":memory:", auto_migrate=True)
+        self.db.connect()
+
+    def tearDown(self):
+        self.db.close()
+        self.temp_dir.cleanup()
+
+    def publish(self, data: bytes, filename: str) -> str:
+        return self.store.publish(self.store.stage(io.BytesIO(data), filename))
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.publish(b'same bytes', 'image.JPEG')
+        second = self.publish(b'same bytes', 'other.jpg')
+        self.assertEqual(first, second)
+        self.assertEqual(hashlib.sha256(b'same bytes').hexdigest() + '.jpg', first)
+        self.assertEqual([first], [path.name for path in self.directory.iterdir()])
+
+    def test_same_name_different_content(self):
+        self.assertNotEqual(self.publish(b'one', 'image.jpg'), self.publish(b'two', 'image.jpg'))
+
+    def test_release_keeps_shared_pictures(self):
+        name = self.publish(b'shared', 'a.png')
+        self.db.cursor.executemany('INSERT INTO inventory (id, name, picture) VALUES (?, ?, ?)',
+                                   [(1, 'Hammer', name), (2, 'Wrench', name)])
+        self.db.cursor.execute('DELETE FROM inventory WHERE id = 1')
+        self.assertIsNone(self.store.release(self.db, name))
+        self.assertTrue((self.directory / name).exists())
+        self.db.cursor.execute('DELETE FROM inventory WHERE id = 2')
+        released = self.store.release(self.db, name)
+        self.assertFalse((self.directory / name).exists())
+        self.store.delete(released)
+        self.assertEqual([], list(self.directory.iterdir()))
+
+    def test_restore_after_rollback(self):
+        name = self.publish(b'kept', 'a.png')
+        self.db.cursor.execute('INSERT INTO inventory (id, name, picture) VALUES (1, ?, ?)', ('Hammer', name))
+        self.db.conn.commit()
+        self.db.cursor.execute('DELETE FROM inventory WHERE id = 1')
+        released = self.store.release(self.db, name)
+        self.db.conn.rollback()
+        self.store.restore(released)
+        self.assertEqual([name], [path.name for path in self.directory.iterdir()])
+
+    def test_discard(self):
+        staged = self.store.stage(io.BytesIO(b'unused'), 'x.png')
+        self.store.discard(staged)
+        self.assertEqual([], list(self.directory.iterdir()))
+
+
+if __name__ == "__main__":
+    unittest.main()
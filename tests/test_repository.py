@@ -0,0 +1,147 @@
+import unittest
+
+from server.db.db import DB
+from server.db.repository import ToolRepository, UserRepository, decode_cursor, encode_cursor, search_expression
+
+
+class TestToolRepository(unittest.TestCase):
+    def setUp(self):
+        self.db = DB(":memory:", auto_migrate=True)
+        self.db.connect()
+        self.db.cursor.executemany('INSERT INTO users (id, name) VALUES (?, ?)', [(1, 'Alice'), (2, 'Bob')])
+        self.db.cursor.executemany('''
+            INSERT INTO inventory (id, name, signed_out, holder_id, signed_out_since) VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (1, 'Hammer', False, None, None),
+            (2, 'Wrench', True, 1, '2024-01-01T10:00:00+00:00'),
+            (3, 'Drill', True, 2, '2024-01-02T10:00:00+00:00'),
+            (4, 'Saw', False, None, None),
+        ])
+        self.db.conn.commit()
+        self.repo = ToolRepository(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_get(self):
+        tool = self.repo.get(2)
+        self.assertEqual('Wrench', tool.name)
+        self.assertEqual('Alice', tool.holder_name)
+        self.assertIsNone(self.repo.get(99))
+
+    def test_dashboard_splits_single_query(self):
+        available, signed_out = self.repo.dashboard()
+        self.assertEqual([1, 4], list(available))
+        self.assertEqual([2, 3], list(signed_out))
+        self.assertIsNone(available[1].holder_name)
+        self.assertEqual(('Alice', 'Bob'), (signed_out[2].holder_name, signed_out[3].holder_name))
+
+    def collect_pages(self, repo, sort, descending=False):
+        names, after = [], None
+        while True:
+            page = repo.page(sort, after=after, limit=2, descending=descending)
+            names.append([item.name for item in page.items.values()])
+            after = page.next_cursor
+            if after is None:
+                return names
+
+    def test_page_by_name(self):
+        self.assertEqual([['Drill', 'Hammer'], ['Saw', 'Wrench']], self.collect_pages(self.repo, 'name'))
+        self.assertEqual([['Wrench', 'Saw'], ['Hammer', 'Drill']], self.collect_pages(self.repo, 'name', True))
+
+    def test_page_by_signed_out_since_with_nulls(self):
+        self.assertEqual([['Hammer', 'Saw'], ['Wrench', 'Drill']], self.collect_pages(self.repo, 'signed_out_since'))
+        self.assertEqual([['Drill', 'Wrench'], ['Saw', 'Hammer']],
+                         self.collect_pages(self.repo, 'signed_out_since', True))
+
+    def test_page_with_ties_on_sort_key(self):
+        self.db.cursor.executemany('INSERT INTO inventory (name) VALUES (?)', [('Saw',), ('Saw',)])
+        pages = self.collect_pages(self.repo, 'name')
+        self.assertEqual(['Drill', 'Hammer', 'Saw', 'Saw', 'Saw', 'Wrench'], sum(pages, []))
+
+    def test_page_includes_holder_name(self):
+        page = self.repo.page('name', limit=10)
+        self.assertEqual('Bob', page.items[3].holder_name)
+        self.assertIsNone(page.next_cursor)
+
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        self.db = DB(":memory:", auto_migrate=True)
+        self.db.connect()
+        self.db.cursor.executemany('INSERT INTO inventory (id, name, description) VALUES (?, ?, ?)', [
+            (1, 'Drill', 'Not a hammer'),
+            (2, 'Claw hammer', 'For nails'),
+            (3, 'Hammer', None),
+            (4, 'Café grinder', 'Coffee'),
+        ])
+        self.repo = ToolRepository(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def names(self, query, **kwargs):
+        return [tool.name for tool in self.repo.search(query, **kwargs).items.values()]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(['Hammer', 'Claw hammer', 'Drill'], self.names('hammer'))
+
+    def test_prefix_and_diacritics(self):
+        self.assertEqual(['Hammer', 'Claw hammer', 'Drill'], self.names('ham'))
+        self.assertEqual(['Café grinder'], self.names('cafe gri'))
+
+    def test_pages(self):
+        page = self.repo.search('ham', limit=2)
+        self.assertEqual([3, 2], list(page.items))
+        self.assertEqual([1], list(self.repo.search('ham', after=page.next_cursor, limit=2).items))
+
+    def test_follows_edits(self):
+        self.db.cursor.execute("UPDATE inventory SET name = 'Mallet' WHERE id = 3")
+        self.db.cursor.execute('DELETE FROM inventory WHERE id = 1')
+        self.assertEqual(['Claw hammer'], self.names('hammer'))
+        self.assertEqual(['Mallet'], self.names('mall'))
+
+    def test_query_syntax_is_not_parsed(self):
+        self.assertEqual('"a" "OR" "b"*', search_expression('a OR* (b'))
+        self.assertIsNone(search_expression(' "- '))
+        self.assertEqual([], self.names('NEAR("x'))
+
+
+class TestCursor(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual(('Hammer', 3), decode_cursor(encode_cursor('Hammer', 3)))
+
+    def test_malformed_cursors(self):
+        for cursor in (None, '', 'bad', encode_cursor(1, 2), encode_cursor('a', 'b')):
+            self.assertIsNone(decode_cursor(cursor), cursor)
+
+
+class TestUserRepository(unittest.TestCase):
+    def setUp(self):
+        self.db = DB(":memory:", auto_migrate=True)
+        self.db.connect()
+        self.db.cursor.execute("INSERT INTO users (id, name, barcode, is_admin) VALUES (1, 'Alice', '7', 1)")
+        self.db.conn.commit()
+        self.repo = UserRepository(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_get(self):
+        user = self.repo.get(1)
+        self.assertEqual('Alice', user.name)
+        self.assertEqual('7', user.barcode)
+        self.assertTrue(user.is_admin)
+        self.assertIsNone(self.repo.get(2))
+
+    def test_page_by_barcode(self):
+        self.db.cursor.executemany('INSERT INTO users (name, barcode) VALUES (?, ?)', [('Bob', None), ('Carol', '3')])
+        page = self.repo.page('barcode', limit=2)
+        self.assertEqual(['Bob', 'Carol'], [user.name for user in page.items.values()])
+        page = self.repo.page('barcode', after=page.next_cursor, limit=2)
+        self.assertEqual(['Alice'], [user.name for user in page.items.values()])
+        self.assertIsNone(page.next_cursor)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from server.db.db import DB
+from server.snapshot_cache import SnapshotCache
+
+
+class TestDataGeneration(unittest.TestCase):
+    def setUp(self):
+        self.db = DB(":memory:", auto_migrate=True)
+        self.db.connect()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_writes_bump_generation(self):
+        generation = self.db.data_generation()
+        for statement in (
+            "INSERT INTO users (id, name) VALUES (1, 'Alice')",
+            "UPDATE users SET name = 'Alicia' WHERE id = 1",
+            "INSERT INTO inventory (id, name) VALUES (1, 'Hammer')",
+            "UPDATE inventory SET signed_out = 1, holder_id = 1 WHERE id = 1",
+            "DELETE FROM inventory WHERE id = 1",
+            "DELETE FROM users WHERE id = 1",
+        ):
+            self.db.cursor.execute(statement)
+            self.assertGreater(self.db.data_generation(), generation, statement)
+            generation = self.db.data_generation()
+
+    def test_reads_do_not_bump_generation(self):
+        generation = self.db.data_generation()
+        self.db.cursor.execute('SELECT * FROM inventory')
+        self.assertEqual(generation, self.db.data_generation())
+
+
+class TestSnapshotCache(unittest.TestCase):
+    def setUp(self):
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return self.loads
+
+    def test_cached_within_generation(self):
+        cache = SnapshotCache()
+        self.assertEqual(1, cache.get('key', 1, self.load))
+        self.assertEqual(1, cache.get('key', 1, self.load))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_reloaded_after_generation_changes(self):
+        cache = SnapshotCache()
+        cache.get('key', 1, self.load)
+        self.assertEqual(2, cache.get('key', 2, self.load))
+        self.assertEqual(2, cache.get('key', 2, self.load))
+
+    def test_keys_are_independent(self):
+        cache = SnapshotCache()
+        self.assertEqual(1, cache.get('a', 1, self.load))
+        self.assertEqual(2, cache.get('b', 1, self.load))
+        self.assertEqual(1, cache.get('a', 1, self.load))
+
+    def test_bounded_entries(self):
+        cache = SnapshotCache(max_entries=2)
+        for key in ('a', 'b', 'c'):
+            cache.get(key, 1, self.load)
+        self.assertEqual(4, cache.get('a', 1, self.load))
+        self.assertEqual(3, cache.get('c', 1, self.load))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -90,6 +90,23 @@ class TestTool(unittest.TestCase):
         self.assertIsNone(tool.holder_id)
         self.assertIsNone(tool.signed_out_since)
 
+    def test_from_row_converts_lazily(self):
+        since = datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc)
+        tool = Tool.from_row((1, 'Drill', None, '', 'drill.png', True, 2, since.isoformat()))
+        self.assertEqual('drill.png', tool.picture_url)
+        self.assertEqual(Path('drill.png'), tool.picture)
+        self.assertEqual(since, tool.signed_out_since)
+        self.assertIs(tool.signed_out_since, tool.signed_out_since)
+        self.assertFalse(hasattr(tool, '__dict__'))
+
+    def test_to_row_and_projection(self):
+        tool = Tool(None, 'Saw', '7', 'cuts', 'saw.png', False, None, None)
+        row, projection = tool.to_row_and_projection()
+        self.assertEqual((None, 'Saw', '7', 'cuts', 'saw.png', False, None, None), row)
+        self.assertEqual('(id,name,barcode,description,picture,signed_out,holder_id,signed_out_since)',
+                         projection[0])
+        self.assertEqual('(?,?,?,?,?,?,?,?)', projection[1])
+
 
 if __name__ == "__main__":
     unittest.main()
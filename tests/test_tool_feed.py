@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from server.db.db import DB
+from server.tool_feed import ToolFeed, last_change_id
+
+
+class TestToolFeed(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'inventory.db')
+        self.db = DB(self.db_path, auto_migrate=True)
+        self.db.cursor.execute("INSERT INTO users (id, name) VALUES (1, 'Alice')")
+        self.db.cursor.executemany('INSERT INTO inventory (id, name) VALUES (?, ?)', [(1, 'Hammer'), (2, 'Wrench')])
+        self.db.conn.commit()
+        self.feed = ToolFeed(self.db_path, poll_interval=0.05)
+        self.subscriptions = []
+
+    def tearDown(self):
+        for subscription in self.subscriptions:
+            self.feed.unsubscribe(subscription)
+        self.db.close()
+        self.temp_dir.cleanup()
+
+    def subscribe(self, since):
+        subscription = self.feed.subscribe(since)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def test_changes_since_are_caught_up_in_order(self):
+        since = last_change_id(self.db)
+        self.db.cursor.execute('UPDATE inventory SET signed_out = 1, holder_id = 1 WHERE id = 2')
+        self.db.cursor.execute("UPDATE inventory SET name = 'Claw hammer' WHERE id = 1")
+        self.db.cursor.execute("UPDATE inventory SET description = 'Heavy' WHERE id = 1")
+        self.db.conn.commit()
+
+        changes = self.subscribe(since).wait(timeout=5)
+        self.assertEqual([2, 1], [change.tool_id for change in changes])
+        self.assertEqual('Alice', changes[0].tool.holder_name)
+        self.assertEqual(('Claw hammer', 'Heavy'), (changes[1].tool.name, changes[1].tool.description))
+        self.assertEqual(last_change_id(self.db), changes[1].change_id)
+
+    def test_deleted_tool_has_no_row(self):
+        since = last_change_id(self.db)
+        self.db.cursor.execute('DELETE FROM inventory WHERE id = 1')
+        self.db.conn.commit()
+        changes = self.subscribe(since).wait(timeout=5)
+        self.assertEqual([(1, None)], [(change.tool_id, change.tool) for change in changes])
+
+    def test_holder_rename_changes_their_tools(self):
+        self.db.cursor.execute('UPDATE inventory SET signed_out = 1, holder_id = 1 WHERE id = 1')
+        self.db.conn.commit()
+        since = last_change_id(self.db)
+        self.db.cursor.execute("UPDATE users SET name = 'Alicia' WHERE id = 1")
+        self.db.conn.commit()
+        changes = self.subscribe(since).wait(timeout=5)
+        self.assertEqual(['Alicia'], [change.tool.holder_name for change in changes])
+
+    def test_every_subscriber_gets_the_change(self):
+        since = last_change_id(self.db)
+        first, second = self.subscribe(since), self.subscribe(since)
+        self.db.cursor.execute('DELETE FROM inventory WHERE id = 2')
+        self.db.conn.commit()
+        self.feed.poke()
+        for subscription in (first, second):
+            self.assertEqual([2], [change.tool_id for change in subscription.wait(timeout=5)])
+
+    def test_subscriber_too_far_behind_is_lost(self):
+        self.db.cursor.executemany('INSERT INTO inventory (name) VALUES (?)', [('Saw',)] * 1100)
+        self.db.conn.commit()
+        self.assertIsNone(self.subscribe(0).wait(timeout=5))
+        self.assertIsNone(self.subscribe(last_change_id(self.db) + 10).wait(timeout=5))
+
+
+if __name__ == "__main__":
+    unittest.main()